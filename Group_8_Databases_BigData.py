@@ -14,37 +14,133 @@ def loading():
 
 
 import mysql.connector
+import mysql.connector.pooling
+import numpy as np
 import pandas as pd
 from IPython.display import display # we don't use this in the final version
 from rich.console import Console
 from rich.table import Table
 from rich import print
 from rich.progress import Progress
+import argparse
+import codecs
 import getpass
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather # optional, only the parsed-dataset cache (CACHE_DIR) needs it
+except ImportError:
+    feather = None
 
 username = None # change to your own username, or don't theres more than enough error handling...
 password = None #change to your own password
 host = None #change host if needed 
 filepath = None
 
+LOAD_MODE = "batched" # how "Initialize" loads the CSV: "batched" (default), "infile" (LOAD DATA), "streaming" (chunks),
+                      # "incremental" (keep the database, apply only what changed) or "row" (one INSERT per row)
+BATCH_SIZE = 1000 # rows per multi-row INSERT in "batched" mode
+CHUNK_SIZE = 50000 # CSV rows read, transformed and written at a time in "streaming" mode
+ENCODING_SAMPLE_BYTES = 1 << 20 # bytes read from the start of the CSV to choose between UTF-8 and cp1252
+DEDUPE_ATTRIBUTES = True # bulk loaders store each distinct attribute vector once, shared by all tracks that have it
+STAGING_DIR = None # where "infile" mode writes its TSV files, None uses a temporary folder that is removed afterwards
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024 # memory cap of the query result cache, least recently used results go first
+POOL_SIZE = 5 # connections to spotify_db kept open for loads, queries and the playlist generator
+REPORT_DIR = None # "Run all" also writes one CSV per query here, None only displays the report
+PAGE_SIZE = 50 # rows per page when the QUERIES MENU shows a result
+PAGE_WAIT_TIMEOUT = 3600 # seconds MySQL keeps a paged result open while the menu waits at its prompt (net_write_timeout)
+BACKEND = "mysql" # "mysql" (server, needs the credentials) or "sqlite" (embedded, no server, stored in SQLITE_PATH)
+SQLITE_PATH = "spotify_db.sqlite"
+QUERY_ENGINE = "sql" # "columnar" answers queries 1, 4, 6 and 7 from NumPy arrays of the CSV instead of the database
+CACHE_DIR = ".spotify_cache" # parsed CSVs are kept here as Arrow (Feather) files, None turns the cache off (needs pyarrow)
+BENCHMARK_REPEAT = 5 # runs per timing in the benchmark suite, the median is reported
+BENCHMARK_THRESHOLD = 0.25 # a timing this much slower than the baseline (25%) is a regression...
+BENCHMARK_MIN_MS = 2.0 # ...unless it is also less than this many ms slower, smaller differences are noise
+SYNTHETIC_BASE_ROWS = 953 # rows of the Kaggle file, a synthetic CSV at scale 10 has 10 times as many
+SYNTHETIC_CORRUPT_RATE = 0.001 # share of synthetic rows whose streams value is garbage, like one row of the real file
+METRICS_FILE = None # statement metrics are written here in the Prometheus text format, None writes nothing
+METRICS_PORT = None # serve the same metrics on http://127.0.0.1:<port>/metrics while the program runs
+
 # MySQL connection details
 config = {
     "user": username,          
     "password": password,  
-    "host": host
+    "host": host,
+    "allow_local_infile": True # needed for LOAD DATA LOCAL INFILE ("infile" mode)
 }
 
 # Connect to MySQL (used later)
 def connect_db():
-    return mysql.connector.connect(**config) # used unpacking
+    if BACKEND == "sqlite":
+        return InstrumentedConnection(SQLiteConnection(SQLITE_PATH))
+    return InstrumentedConnection(mysql.connector.connect(**config)) # used unpacking
+
+# what a failed statement raises on either backend
+database_errors = (mysql.connector.Error, sqlite3.Error)
+
+# connections to spotify_db, created on first use (after the credentials are entered)
+connection_pool = None
+connection_pool_lock = threading.Lock() # "Run all" asks for connections from several threads at once
+
+def get_pool():
+    global connection_pool
+    if connection_pool is None:
+        with connection_pool_lock:
+            if connection_pool is None: # another thread may have built it while this one waited
+                # pooled connections open spotify_db directly, so it has to exist first
+                admin = connect_db()
+                admin.cursor().execute("CREATE DATABASE IF NOT EXISTS spotify_db")
+                admin.close()
+                connection_pool = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_name="spotify_pool", pool_size=POOL_SIZE, database="spotify_db", **config)
+    return connection_pool
+
+# forget the pool after a drop or new credentials and disconnect its idle connections,
+# the next get_pool() connects again (a connection still in use goes back to the old pool and is freed with it)
+def reset_pool():
+    global connection_pool
+    with connection_pool_lock:
+        pool, connection_pool = connection_pool, None
+    while pool is not None:
+        try:
+            pool.get_connection().disconnect() # taken out and never given back
+        except database_errors: # PoolError once no idle connection is left
+            break
+
+# one connection per operation: "with pooled_connection() as conn:"
+# (the pool itself reconnects a connection MySQL closed after wait_timeout before handing it out)
+@contextmanager
+def pooled_connection():
+    conn = connect_db() if BACKEND == "sqlite" else InstrumentedConnection(get_pool().get_connection()) # opening SQLite costs nothing
+    try:
+        yield conn
+    finally:
+        conn.close() # back to the pool, uncommitted changes are rolled back
 
 # Drop the database (used later)
 def drop_database(cursor, db_name):
     try:
         # Drop the database if it exists
         cursor.execute(f"DROP DATABASE IF EXISTS {db_name}")
+        clear_dimension_cache()
+        bump_data_version()
+        reset_pool() # its connections still point at the dropped database
         #print(f"Database {db_name} dropped successfully.") #used in early stages
-    except mysql.connector.Error as err:
+    except database_errors as err:
         print(f"Error: {err}")
 
 # Create the database if it doesn't exist (used later)
@@ -54,23 +150,366 @@ def create_database(cursor):
 
 def runProgram():
     try:
-        create_database(cursor)
-        #print("Database created successfully.") # used in the early stages to check
-
-        create_tables(cursor)
-        conn.commit()
-
-        populate_tables(cursor)
-        conn.commit()
-        #print("Tables created and populated successfully.")  # also used in the early stages to check
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            create_database(cursor)
+            #print("Database created successfully.") # used in the early stages to check
+
+            with call_site("schema"):
+                create_tables(cursor)
+                missing = outdated_columns(cursor)
+            conn.commit()
+            if missing:
+                # the rows already stored cannot be keyed or deduplicated without them, so nothing is loaded
+                print(f"[red]The existing spotify_db tables were created by an older version (missing {', '.join(missing)}).[/red]")
+                print("[red]Drop the spotify_db database (or delete the SQLite file) and load again to recreate them.[/red]")
+                return False
+
+            with call_site("load"):
+                loaded = loaders[LOAD_MODE](cursor) # False when an incremental load found nothing to do
+            conn.commit()
+
+            with call_site("indexes"):
+                create_indexes(cursor) # after the load, building an index once is cheaper than updating it per row
+            if loaded is not False:
+                with call_site("platform_stats"):
+                    refresh_platform_stats(cursor)
+            conn.commit()
+
+            if loaded is not False:
+                bump_data_version() # cached query results belong to the old data
+            precompute_playlists(cursor) # query 8 becomes a lookup
+            #print("Tables created and populated successfully.")  # also used in the early stages to check
+        return True
         
-    except mysql.connector.Error as err:
+    except database_errors as err:
         print(f"Error: {err}")
+        return False
+
+
+# --- --- --- STATEMENT INSTRUMENTATION --- --- ---
+
+
+# every cursor the program opens counts its statements, their latency and the rows they return, per call site
+# the call site is a label set with "with call_site('query.3'):" around the code that runs the statements
+# (the innermost label wins, statements outside any label count as "other")
+call_sites = threading.local() # "Run all" labels from several threads at once
+
+@contextmanager
+def call_site(label):
+    stack = call_sites.__dict__.setdefault("stack", [])
+    stack.append(label)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+def current_call_site():
+    stack = getattr(call_sites, "stack", None)
+    return stack[-1] if stack else "other"
+
+# upper bounds (seconds) of the latency histogram buckets, like Prometheus' defaults with a few sub-ms ones
+statement_buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# call site -> counters, since the program started (or since the reset in (m) Miscellaneous)
+statement_metrics = {}
+statement_metrics_lock = threading.Lock()
+
+def site_metrics(site):
+    return statement_metrics.setdefault(site, {"statements": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                               "buckets": [0] * len(statement_buckets), "rows": 0, "fetch_seconds": 0.0})
+
+# one execute() on the database: a round trip, its latency and whether it failed
+def record_statement(site, seconds, failed=False):
+    with statement_metrics_lock:
+        metrics = site_metrics(site)
+        metrics["statements"] += 1
+        metrics["errors"] += failed
+        metrics["seconds"] += seconds
+        metrics["max_seconds"] = max(metrics["max_seconds"], seconds)
+        for i, bound in enumerate(statement_buckets):
+            if seconds <= bound:
+                metrics["buckets"][i] += 1
+                break
+
+# rows handed back by fetchone/fetchmany/fetchall (for unbuffered results the fetch is where the rows travel)
+def record_fetch(site, rows, seconds):
+    with statement_metrics_lock:
+        metrics = site_metrics(site)
+        metrics["rows"] += rows
+        metrics["fetch_seconds"] += seconds
+
+def clear_statement_metrics():
+    with statement_metrics_lock:
+        statement_metrics.clear()
+
+# a cursor of either backend, with every execute and fetch recorded under the call site of its last execute
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.site = "other"
+
+    def execute(self, statement, params=None):
+        self.site = current_call_site()
+        start, failed = time.perf_counter(), True
+        try:
+            result = self.cursor.execute(statement, params)
+            failed = False
+            return result
+        finally:
+            record_statement(self.site, time.perf_counter() - start, failed)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        record_fetch(self.site, 0 if row is None else 1, time.perf_counter() - start)
+        return row
+
+    def fetchmany(self, size=1):
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(size)
+        record_fetch(self.site, len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        record_fetch(self.site, len(rows), time.perf_counter() - start)
+        return rows
+
+    def __getattr__(self, name): # description, rowcount, close, ...
+        return getattr(self.cursor, name)
+
+# a connection whose cursors are instrumented, everything else goes to the real connection
+class InstrumentedConnection:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name): # commit, ping, close, ...
+        return getattr(self.connection, name)
+
+# the metrics in the Prometheus text exposition format
+def prometheus_metrics():
+    with statement_metrics_lock:
+        sites = {site: {**metrics, "buckets": list(metrics["buckets"])} for site, metrics in sorted(statement_metrics.items())}
+
+    label = lambda site: 'site="' + site.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    lines = []
+    for name, kind, description, key in [
+            ("spotify_db_statements_total", "counter", "Statements sent to the database.", "statements"),
+            ("spotify_db_statement_errors_total", "counter", "Statements that raised an error.", "errors"),
+            ("spotify_db_rows_returned_total", "counter", "Rows fetched from result sets.", "rows"),
+            ("spotify_db_fetch_seconds_total", "counter", "Time spent fetching rows.", "fetch_seconds")]:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{{{label(site)}}} {metrics[key]}" for site, metrics in sites.items()]
+
+    name = "spotify_db_statement_duration_seconds"
+    lines += [f"# HELP {name} Time spent in cursor.execute().", f"# TYPE {name} histogram"]
+    for site, metrics in sites.items():
+        cumulative = 0
+        for bound, count in zip(statement_buckets, metrics["buckets"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label(site)},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label(site)},le="+Inf"}} {metrics["statements"]}')
+        lines.append(f"{name}_sum{{{label(site)}}} {metrics['seconds']}")
+        lines.append(f"{name}_count{{{label(site)}}} {metrics['statements']}")
+    return "\n".join(lines) + "\n"
+
+# written to a temporary file first, so a collector never reads half a file
+def write_metrics_file(path=None):
+    path = path or METRICS_FILE
+    with open(path + ".tmp", "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(prometheus_metrics())
+    os.replace(path + ".tmp", path)
+
+# GET /metrics on the local endpoint
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+        body = prometheus_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # requests would print into the menu
+
+# serve the metrics from a background thread, on this machine only
+def serve_metrics(port=None):
+    server = ThreadingHTTPServer(("127.0.0.1", port or METRICS_PORT), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# per call site: statements, errors, rows, total/average/max latency, busiest first
+def statement_summary():
+    with statement_metrics_lock:
+        rows = [(site, metrics["statements"], metrics["errors"], metrics["rows"], round(metrics["seconds"] * 1000, 1),
+                 round(metrics["seconds"] * 1000 / metrics["statements"], 3) if metrics["statements"] else 0.0,
+                 round(metrics["max_seconds"] * 1000, 3))
+                for site, metrics in statement_metrics.items()]
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return pd.DataFrame(rows, columns=["Call Site", "Statements", "Errors", "Rows", "Total ms", "Avg ms", "Max ms"])
+
+
+# --- --- --- EMBEDDED BACKEND (SQLite) --- --- ---
+
+
+# BACKEND = "sqlite" runs the same tables, loaders and queries in-process on the file SQLITE_PATH,
+# the MySQL-only SQL is rewritten by adapt_sql (DuckDB was left out: it rejects the queries that
+# SELECT columns missing from their GROUP BY, which MySQL and SQLite both allow)
+
+# (pattern, replacement) pairs, applied in order
+sqlite_rewrites = [
+    (re.compile(r"INT AUTO_INCREMENT PRIMARY KEY"), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\b(?:VAR)?CHAR\(\d+\)"), "TEXT COLLATE NOCASE"), # MySQL's default collation is case-insensitive
+    (re.compile(r"(\w+) ENUM\(([^)]*)\)"), r"\1 TEXT CHECK (\1 IN (\2))"),
+    (re.compile(r"UNIQUE KEY \w+ \("), "UNIQUE ("),
+    (re.compile(r"INSERT IGNORE"), "INSERT OR IGNORE"),
+    (re.compile(r"ON DUPLICATE KEY UPDATE"), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"\bVALUES\((\w+)\)"), r"excluded.\1"),
+    (re.compile(r"\bGREATEST\("), "MAX("),
+    (re.compile(r"AS SIGNED\)"), "AS INTEGER)"),
+    # GROUP_CONCAT(DISTINCT x ORDER BY y SEPARATOR ', '): SQLite takes one argument with DISTINCT and no ORDER BY
+    # (artist names never contain a comma, they are split on it)
+    (re.compile(r"GROUP_CONCAT\(DISTINCT\s+(.+?)(?:\s+ORDER BY\s+[^)]*?)?\s+SEPARATOR\s+('[^']*')\)"),
+     r"REPLACE(GROUP_CONCAT(DISTINCT \1), ',', \2)"),
+    (re.compile(r"GROUP_CONCAT\((.+?)(?:\s+ORDER BY\s+[^)]*?)?\s+SEPARATOR\s+('[^']*')\)"), r"GROUP_CONCAT(\1, \2)"),
+    # FIELD(x, 'a', 'b') -> CASE x WHEN 'a' THEN 1 WHEN 'b' THEN 2 ELSE 0 END
+    (re.compile(r"\bFIELD\(([^,()]+),([^()]*)\)"), lambda match: "CASE " + match[1] + "".join(
+        f" WHEN {value.strip()} THEN {position}" for position, value in enumerate(match[2].split(","), 1)) + " ELSE 0 END"),
+    (re.compile(r"%s"), "?")
+]
+
+# the loaders send the same statement text over and over (a full batch of INSERTs, the playlist SQL),
+# so each text is rewritten once
+@lru_cache(maxsize=256)
+def adapt_sql(statement):
+    for pattern, replacement in sqlite_rewrites:
+        statement = pattern.sub(replacement, statement)
+    return statement
+
+# STDDEV (population standard deviation, like MySQL's) as an aggregate and window function
+class SQLiteStddev:
+    def __init__(self):
+        self.count, self.total, self.squares = 0, 0.0, 0.0
+
+    def step(self, value):
+        if value is not None:
+            self.count, self.total, self.squares = self.count + 1, self.total + value, self.squares + value * value
+
+    def inverse(self, value):
+        if value is not None:
+            self.count, self.total, self.squares = self.count - 1, self.total - value, self.squares - value * value
+
+    def value(self):
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return max(self.squares / self.count - mean * mean, 0.0) ** 0.5
+
+    finalize = value
+
+# DB-API cursor that speaks the MySQL dialect used in this file
+class SQLiteCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.sqlite.cursor()
+
+    def execute(self, statement, params=None):
+        words = statement.split()
+        if words[:2] == ["CREATE", "DATABASE"] or words[:1] == ["USE"]:
+            return # the file is the database
+        if words[:2] == ["DROP", "DATABASE"]:
+            return self.connection.drop_tables()
+
+        self.connection.insert_id_set = False
+        self.cursor.execute(adapt_sql(statement), tuple(params or ()))
+        # LAST_INSERT_ID() follows the last INSERT, unless the statement set it with LAST_INSERT_ID(expr)
+        if words[0].upper() == "INSERT" and self.cursor.rowcount > 0 and not self.connection.insert_id_set:
+            self.connection.insert_id = self.cursor.lastrowid
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+# the connection side: what runProgram, the pool and the menu call on a MySQL connection
+class SQLiteConnection:
+    def __init__(self, path):
+        self.sqlite = sqlite3.connect(path, timeout=30)
+        self.sqlite.execute("PRAGMA journal_mode = WAL") # readers don't wait for the loader
+        self.sqlite.execute("PRAGMA synchronous = NORMAL")
+        self.insert_id, self.insert_id_set = 0, False
+        self.sqlite.create_function("LAST_INSERT_ID", -1, self.last_insert_id)
+        if hasattr(self.sqlite, "create_window_function"): # Python 3.11+, query 3 uses STDDEV() OVER
+            self.sqlite.create_window_function("STDDEV", 1, SQLiteStddev)
+        else:
+            self.sqlite.create_aggregate("STDDEV", 1, SQLiteStddev)
+
+    def last_insert_id(self, *value):
+        if value:
+            self.insert_id, self.insert_id_set = value[0], True
+            return value[0]
+        return self.insert_id
+
+    def drop_tables(self):
+        tables = [row[0] for row in self.sqlite.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        for table in tables:
+            self.sqlite.execute(f"DROP TABLE IF EXISTS {table}")
+        self.sqlite.commit()
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass # nothing to reconnect to
+
+    def close(self):
+        self.sqlite.close()
 
 
 # --- --- --- CREATE THE TABLES --- --- ---
 
 
+# danceability bucket of query 3, stored so it is computed once per row and can be indexed
+danceability_range_column = """danceability_range VARCHAR(10) AS (
+            CASE
+                WHEN danceability <= 30 THEN '0-30%'
+                WHEN danceability <= 50 THEN '31-50%'
+                WHEN danceability <= 60 THEN '51-60%'
+                WHEN danceability <= 80 THEN '61-80%'
+                ELSE '81-100%'
+            END) STORED"""
+
 # Create tables based on the ER diagram with relationship tables for ease of calulationg
 def create_tables(cursor):
     cursor.execute("""
@@ -89,12 +528,14 @@ def create_tables(cursor):
     CREATE TABLE IF NOT EXISTS Track (
         track_id INT AUTO_INCREMENT PRIMARY KEY,
         track_name VARCHAR(255) NOT NULL,
+        artists_name VARCHAR(255),
         release_year INT,
         release_month INT,
-        release_day INT
+        release_day INT,
+        UNIQUE KEY track_natural_key (track_name, artists_name, release_year, release_month, release_day)
     );
     """)
-    cursor.execute("""
+    cursor.execute(f"""
     CREATE TABLE IF NOT EXISTS MusicalAttributes (
         music_id INT AUTO_INCREMENT PRIMARY KEY,
         bpm FLOAT,
@@ -106,9 +547,13 @@ def create_tables(cursor):
         acousticness FLOAT,
         instrumentalness FLOAT,
         liveness FLOAT,
-        speechiness FLOAT
+        speechiness FLOAT,
+        attributes_hash BIGINT,
+        {danceability_range_column},
+        UNIQUE KEY attributes_hash (attributes_hash)
     );
     """)
+    add_danceability_range(cursor)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS TrackMusicalAttributes (
         track_id INT,
@@ -138,50 +583,310 @@ def create_tables(cursor):
         FOREIGN KEY (artist_id) REFERENCES Artist(artist_id)
     );
     """)# Artist-Track relationship
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS IdSequence (
+        table_name VARCHAR(64) PRIMARY KEY,
+        next_id INT NOT NULL
+    );
+    """)# IDs handed out by the bulk loaders (see reserve_ids)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS TrackFingerprint (
+        track_id INT PRIMARY KEY,
+        fingerprint BIGINT NOT NULL,
+        FOREIGN KEY (track_id) REFERENCES Track(track_id)
+    );
+    """)# hash of each track's CSV row, to find changed rows on an incremental load
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS LoadMetadata (
+        load_id INT AUTO_INCREMENT PRIMARY KEY,
+        file_path VARCHAR(1024),
+        file_hash CHAR(64) NOT NULL,
+        row_count INT,
+        loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)# one row per load of the CSV file
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS PlatformStats (
+        platform_id INT PRIMARY KEY,
+        avg_playlists DOUBLE,
+        stddev_playlists DOUBLE,
+        avg_inverted_chart_rank DOUBLE,
+        stddev_inverted_chart_rank DOUBLE,
+        avg_streams DOUBLE,
+        stddev_streams DOUBLE,
+        FOREIGN KEY (platform_id) REFERENCES Platform(platform_id)
+    );
+    """)# per-platform metric statistics used by query 2, rebuilt after every load
+
+
+def column_exists(cursor, table, column):
+    if BACKEND == "sqlite":
+        cursor.execute(f"SELECT COUNT(*) FROM pragma_table_xinfo('{table}') WHERE name = %s", (column,))
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+# tables created before the danceability_range column existed (kept by "incremental" mode) get it here
+def add_danceability_range(cursor):
+    if not column_exists(cursor, "MusicalAttributes", "danceability_range"):
+        cursor.execute(f"ALTER TABLE MusicalAttributes ADD COLUMN {danceability_range_column}")
+
+# columns the loaders need that tables created by an older version of the program do not have
+# (the track unique key is built on Track.artists_name, shared attribute vectors are found by their hash)
+required_columns = {"Track": "artists_name", "MusicalAttributes": "attributes_hash"}
+
+# "Table.column" of every required column the existing tables lack, empty for an up-to-date schema
+def outdated_columns(cursor):
+    return [f"{table}.{column}" for table, column in required_columns.items() if not column_exists(cursor, table, column)]
+
+
+# secondary indexes for the filters, joins and sorts in the queries dict and the playlist generator
+# (the foreign keys already index TrackMusicalAttributes.music_id, TrackArtist.artist_id and StreamingMetric.track_id)
+secondary_indexes = {
+    "StreamingMetric": {
+        "idx_metric_platform_type_value": "platform_id, metric_type, metric_value", # queries 2, 3, 5, 6, 7 and the playlist fallback
+        "idx_metric_track_type": "track_id, metric_type, metric_value" # metrics of one track, reached from Track
+    },
+    "MusicalAttributes": {
+        "idx_attributes_energy": "energy, speechiness", # queries 4, 6 and the playlist
+        "idx_attributes_danceability": "danceability, valence", # queries 4, 7 and the playlist
+        "idx_attributes_danceability_range": "danceability_range", # query 3, partitions by bucket
+        "idx_attributes_valence": "valence, energy", # queries 4, 7 and the playlist
+        "idx_attributes_bpm": "bpm" # queries 1, 4 (ORDER BY bpm) and the playlist
+    },
+    "Track": {
+        "idx_track_release_month": "release_month" # query 1, season of release
+    }
+}
+
+# add the indexes that don't exist yet, one ALTER TABLE per table
+def create_indexes(cursor):
+    if BACKEND == "sqlite": # SQLite has CREATE INDEX IF NOT EXISTS, one index per statement
+        for table, indexes in secondary_indexes.items():
+            for name, columns in indexes.items():
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        return
+
+    cursor.execute("SELECT DISTINCT table_name, index_name FROM information_schema.statistics WHERE table_schema = DATABASE()")
+    existing = {(table.lower(), index.lower()) for table, index in cursor.fetchall()}
+
+    for table, indexes in secondary_indexes.items():
+        missing = [f"ADD INDEX {name} ({columns})" for name, columns in indexes.items()
+                   if (table.lower(), name.lower()) not in existing]
+        if missing:
+            cursor.execute(f"ALTER TABLE {table} {', '.join(missing)}")
+
+
+# recompute PlatformStats from StreamingMetric, one pass over the table
+# (streams only exist for Spotify, so avg_streams is NULL for the other platforms)
+def refresh_platform_stats(cursor):
+    cursor.execute("DELETE FROM PlatformStats")
+    cursor.execute("""
+        INSERT INTO PlatformStats (platform_id, avg_playlists, stddev_playlists, avg_inverted_chart_rank,
+                                   stddev_inverted_chart_rank, avg_streams, stddev_streams)
+        SELECT 
+            SM.platform_id,
+            AVG(CASE WHEN SM.metric_type = 'in_playlists' THEN SM.metric_value END),
+            STDDEV(CASE WHEN SM.metric_type = 'in_playlists' THEN SM.metric_value END),
+            AVG(CASE WHEN SM.metric_type = 'in_charts' THEN 1.0 / NULLIF(SM.metric_value, 0) END),
+            STDDEV(CASE WHEN SM.metric_type = 'in_charts' THEN 1.0 / NULLIF(SM.metric_value, 0) END),
+            AVG(CASE WHEN SM.metric_type = 'streams' THEN SM.metric_value END),
+            STDDEV(CASE WHEN SM.metric_type = 'streams' THEN SM.metric_value END)
+        FROM StreamingMetric SM
+        GROUP BY SM.platform_id
+    """)
 
 
 # --- --- --- POPULATE THE TABLES --- --- ---
 
 
-# function to populate ALL tables
+platforms = ["Spotify", "Shazam", "Deezer", "Apple"]
+
+# the only columns that hold free text, everything else is numbers or short codes
+text_columns = ['track_name', 'artist(s)_name']
+
+# declared dtypes of the other columns, instead of the int64/float64/object read_csv infers
+# counts pass 4 billion (streams) and can be missing or corrupt, so they are nullable Int64
+count_columns = ['in_spotify_playlists', 'in_spotify_charts', 'streams', 'in_apple_playlists', 'in_apple_charts',
+                 'in_deezer_playlists', 'in_deezer_charts', 'in_shazam_charts']
+percentage_columns = ['danceability_%', 'valence_%', 'energy_%', 'acousticness_%', 'instrumentalness_%',
+                      'liveness_%', 'speechiness_%']
+csv_schema = {
+    'artist_count': 'UInt8', 'released_year': 'UInt16', 'released_month': 'UInt8', 'released_day': 'UInt8',
+    **{column: 'Int64' for column in count_columns},
+    'bpm': 'Float64', 'key': 'category', 'mode': 'category', # MusicalAttributes.bpm is a FLOAT, 120.5 is valid
+    **{column: 'UInt8' for column in percentage_columns}
+}
+CSV_SCHEMA_VERSION = 4 # part of the cache file name, frames cached with an older schema are parsed again
+
+# decide the encoding once from the first bytes of the file: UTF-8 (with or without BOM) if they decode, else cp1252
+def detect_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False) # a character cut at the end is fine
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+# non-ASCII characters in UTF-8 files (and undecodable bytes further in) become "?", text columns only
+def sanitize_text_columns(spotify_df, encoding):
+    if encoding.startswith('utf-8'):
+        for column in text_columns:
+            if column in spotify_df and not pd.api.types.is_numeric_dtype(spotify_df[column]):
+                spotify_df[column] = spotify_df[column].str.replace(r'[^\x00-\x7F]+', '?', regex=True)
+    return spotify_df
+
+# key and mode are categories straight from the parser, "1,234" is read as 1234
+csv_read_options = {"dtype": {column: dtype for column, dtype in csv_schema.items() if dtype == 'category'},
+                    "thousands": ","}
+
+# cast the number columns to their declared dtype
+# a value that doesn't parse (text in streams) or is out of range for the type becomes missing, which the loaders
+# store as 0 or NULL like before; a percentage column with fractions is kept as Float64 instead of UInt8,
+# a fraction in a count or a date is corrupt and becomes missing too (--check-schema lists the values that changed)
+def apply_csv_schema(spotify_df):
+    for column, dtype in csv_schema.items():
+        if column not in spotify_df or dtype == 'category':
+            continue
+        values = spotify_df[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values.astype(str).str.replace(",", "", regex=False), errors="coerce")
+        if dtype.startswith('Float'):
+            spotify_df[column] = values.astype(dtype)
+            continue
+        limits = np.iinfo(dtype.lower())
+        valid = values.between(limits.min, limits.max)
+        whole = values == values.round()
+        if column in percentage_columns and not whole[valid].all():
+            dtype = 'Float64' # a measured value, 55.5% is valid
+        else:
+            valid &= whole
+        spotify_df[column] = values.where(valid).astype(dtype)
+    return spotify_df
+
+# parse the CSV file in one pass, with the encoding detected from a sample
+def parse_spotify_csv(path):
+    with open(path, "rb") as csv_file:
+        encoding = detect_encoding(csv_file.read(ENCODING_SAMPLE_BYTES))
+    spotify_df = pd.read_csv(path, encoding=encoding, encoding_errors='replace', **csv_read_options)
+    return apply_csv_schema(sanitize_text_columns(spotify_df, encoding))
+
+# SHA-256 of the file at path, from CACHE_DIR/index.json while its size and mtime are unchanged
+# index.json keeps size, mtime and hash per path, so an unchanged file is not even read to be hashed
+def dataset_file_hash(path):
+    if not CACHE_DIR:
+        return file_sha256(path)
+    index_path = os.path.join(CACHE_DIR, "index.json")
+    try:
+        with open(index_path, encoding="utf-8") as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        index = {}
+
+    stat = os.stat(path)
+    old_entry = index.get(os.path.abspath(path))
+    if old_entry and old_entry["size"] == stat.st_size and old_entry["mtime_ns"] == stat.st_mtime_ns:
+        return old_entry["sha256"]
+
+    # new or touched file: hash it, a file that was only touched still finds its old cache
+    file_hash = file_sha256(path)
+    index[os.path.abspath(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash}
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # a temporary file of its own, runs started at the same time (e.g. by cron) can't write into each other's
+    with tempfile.NamedTemporaryFile("w", dir=CACHE_DIR, suffix=".tmp", delete=False, encoding="utf-8") as index_file:
+        json.dump(index, index_file)
+    os.replace(index_file.name, index_path)
+
+    # the file changed: its old contents are dropped from the cache unless another path still has them
+    if old_entry and all(entry["sha256"] != old_entry["sha256"] for entry in index.values()):
+        remove_cached_copies(old_entry["sha256"])
+    return file_hash
+
+# delete the parsed copies of one file version, all schema versions except keep_version
+def remove_cached_copies(file_hash, keep_version=None):
+    for cache_file in glob.glob(os.path.join(CACHE_DIR, f"{file_hash}.v*.feather")):
+        if not cache_file.endswith(f".v{keep_version}.feather"):
+            try:
+                os.remove(cache_file)
+            except OSError: # another run removed it first
+                pass
+
+# where the parsed copy of a file version lives: CACHE_DIR/<sha256 of the file>.v<schema version>.feather
+def cached_dataset_file(file_hash):
+    return os.path.join(CACHE_DIR, f"{file_hash}.v{CSV_SCHEMA_VERSION}.feather")
+
+# read the CSV file, from the parsed-dataset cache when this exact file was parsed before
+# the cache is uncompressed Arrow, memory-mapped instead of read and parsed
+def read_spotify_csv(path):
+    if not CACHE_DIR or feather is None:
+        return parse_spotify_csv(path)
+
+    file_hash = dataset_file_hash(path)
+    cache_file = cached_dataset_file(file_hash)
+    if os.path.exists(cache_file):
+        try:
+            return feather.read_table(cache_file, memory_map=True).to_pandas()
+        except (pa.ArrowException, OSError): # a damaged copy is removed and written again from the CSV
+            remove_cached_copies(file_hash)
+
+    spotify_df = parse_spotify_csv(path)
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as temporary_file:
+        pass # only the unique name, write_feather opens it again
+    try:
+        feather.write_feather(spotify_df, temporary_file.name, compression="uncompressed")
+        os.replace(temporary_file.name, cache_file)
+        remove_cached_copies(file_hash, CSV_SCHEMA_VERSION) # parsed with an older schema
+    except (pa.ArrowException, TypeError, ValueError): # e.g. a column mixing numbers and text, read from the CSV next time
+        if os.path.exists(temporary_file.name):
+            os.remove(temporary_file.name)
+    return spotify_df
+
+# function to populate ALL tables, one row at a time (the original loader, "row" mode)
 def populate_tables(cursor):
     
     # populate the Platforms Table
-    platforms = ["Spotify", "Shazam", "Deezer", "Apple"]
-    for platform in platforms:
-        cursor.execute("INSERT IGNORE INTO Platform (platform_name) VALUES (%s)", (platform,))
+    with call_site("load.Platform"):
+        for platform in platforms:
+            cursor.execute("INSERT IGNORE INTO Platform (platform_name) VALUES (%s)", (platform,))
 
-    # try reading the CSV file with different encodings
-    try:
-        spotify_df = pd.read_csv(filepath, encoding='utf-8')
-        spotify_df = spotify_df.replace({r'[^\x00-\x7F]+': '?'}, regex=True)
-    except UnicodeDecodeError:
-        spotify_df = pd.read_csv(filepath, encoding='cp1252')
+    # a repeated track would get the first one's ID back from the unique key and a second set of
+    # attributes, links and metrics, so repeats are skipped like in the other loaders
+    spotify_df = unique_tracks(read_spotify_csv(filepath))
 
     # populate the Artist table
-    for artists in spotify_df['artist(s)_name']:
+    with call_site("load.Artist"):
+        for artists in spotify_df['artist(s)_name']:
 
-        # Split multiple artists (e.g., "Latto, Jung Kook") by comma and strip any whitespace
-        individual_artists = [artist.strip() for artist in artists.split(',')]  
+            # Split multiple artists (e.g., "Latto, Jung Kook") by comma and strip any whitespace
+            individual_artists = [artist.strip() for artist in artists.split(',')]  
 
-        # insert each UNIQUE artist into the Artist table
-        for artist in individual_artists:
-            artist = artist.strip()  # remove unnecessary spaces
-            if artist:  # skip empty entires
-                cursor.execute("INSERT IGNORE INTO Artist (artist_name) VALUES (%s)", (artist,))
+            # insert each UNIQUE artist into the Artist table
+            for artist in individual_artists:
+                artist = artist.strip()  # remove unnecessary spaces
+                if artist:  # skip empty entires
+                    cursor.execute("INSERT IGNORE INTO Artist (artist_name) VALUES (%s)", (artist,))
 
-    # populate the Track table
-    for _, row in spotify_df.iterrows():
+    # read every artist and platform ID back once, instead of one SELECT per lookup
+    refresh_dimension_cache(cursor)
 
-        cursor.execute("""
-            INSERT INTO Track (track_name, release_year, release_month, release_day)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE track_name = track_name
-        """, (row['track_name'], row['released_year'], row['released_month'], row['released_day']))
+    # populate the Track table
+    for _, row in spotify_df.astype(object).where(spotify_df.notna(), None).iterrows(): # missing values (pd.NA) as None
+
+        # a track that is already there (same name, artists and release date) returns its own ID
+        with call_site("load.Track"):
+            cursor.execute("""
+                INSERT INTO Track (track_name, artists_name, release_year, release_month, release_day)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE track_id = LAST_INSERT_ID(track_id)
+            """, (row['track_name'], row['artist(s)_name'], row['released_year'], row['released_month'], row['released_day']))
         
-        # get the track ID 
-        cursor.execute("SELECT LAST_INSERT_ID()")
-        track_id = cursor.fetchone()[0]
+            # get the track ID 
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            track_id = cursor.fetchone()[0]
 
         # replace NaN values with None (NULL)
         bpm = row['bpm'] if pd.notna(row['bpm']) else None
@@ -196,38 +901,38 @@ def populate_tables(cursor):
         speechiness = row['speechiness_%'] if pd.notna(row['speechiness_%']) else None
 
         # populate the MusicalAttributes table
-        cursor.execute("""
-            INSERT INTO MusicalAttributes (bpm, key_signature, mode, danceability, valence, energy, acousticness, instrumentalness, liveness, speechiness)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE music_id = music_id
-        """, (bpm, key_signature, mode, danceability, valence, energy, acousticness, instrumentalness, liveness, speechiness))
+        with call_site("load.MusicalAttributes"):
+            cursor.execute("""
+                INSERT INTO MusicalAttributes (bpm, key_signature, mode, danceability, valence, energy, acousticness, instrumentalness, liveness, speechiness)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE music_id = music_id
+            """, (bpm, key_signature, mode, danceability, valence, energy, acousticness, instrumentalness, liveness, speechiness))
 
-        # get the music_id of the row
-        cursor.execute("SELECT LAST_INSERT_ID()")
-        music_id = cursor.fetchone()[0]
+            # get the music_id of the row
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            music_id = cursor.fetchone()[0]
 
         # the relationship between Track and its MusicalAttributes
-        cursor.execute("""
-            INSERT INTO TrackMusicalAttributes (track_id, music_id)
-            VALUES (%s, %s)
-        """, (track_id, music_id))
+        with call_site("load.TrackMusicalAttributes"):
+            cursor.execute("""
+                INSERT INTO TrackMusicalAttributes (track_id, music_id)
+                VALUES (%s, %s)
+            """, (track_id, music_id))
 
         # the relationship between Track and its Artist
         individual_artists = [artist.strip() for artist in row['artist(s)_name'].split(',')]  # can handle multiple artists
         
         for artist in individual_artists:
             # check if artist already exists
-            cursor.execute("SELECT artist_id FROM Artist WHERE artist_name = %s", (artist,))
-            artist_id = cursor.fetchone()
+            artist_id = dimension_id("Artist", artist)
 
             if artist_id:
-                artist_id = artist_id[0]  # extract artist_id
-
                 # insert into TrackArtist 
-                cursor.execute("""
-                    INSERT IGNORE INTO TrackArtist (track_id, artist_id)
-                    VALUES (%s, %s)
-                """, (track_id, artist_id))
+                with call_site("load.TrackArtist"):
+                    cursor.execute("""
+                        INSERT IGNORE INTO TrackArtist (track_id, artist_id)
+                        VALUES (%s, %s)
+                    """, (track_id, artist_id))
 
         
          # populate the StreamingMetric table for each platform and metric type
@@ -251,8 +956,7 @@ def populate_tables(cursor):
         }
 
         for platform, metrics in platforms_data.items():
-            cursor.execute("SELECT platform_id FROM Platform WHERE platform_name = %s", (platform,))
-            platform_id = cursor.fetchone()[0]
+            platform_id = dimension_id("Platform", platform)
 
             # Split metrics string into individual metric-value pairs if necessary                                              #-----------------------
             if isinstance(metrics, str):
@@ -269,10 +973,617 @@ def populate_tables(cursor):
                     metric_value = 0  # default if conversion fails
 
                 # handle each metric type separately
-                cursor.execute("""
-                    INSERT IGNORE INTO StreamingMetric (platform_id, track_id, metric_type, metric_value)
-                    VALUES (%s, %s, %s, %s)
-                """, (platform_id, track_id, metric_type, metric_value))
+                with call_site("load.StreamingMetric"):
+                    cursor.execute("""
+                        INSERT IGNORE INTO StreamingMetric (platform_id, track_id, metric_type, metric_value)
+                        VALUES (%s, %s, %s, %s)
+                    """, (platform_id, track_id, metric_type, metric_value))
+
+
+# --- --- --- DIMENSION CACHE --- --- ---
+
+
+# name -> ID maps for the dimension tables, shared by the loaders, the queries and the playlist generator
+# names are stored in lower case, since the column collation is case-insensitive
+dimension_cache = {"Platform": {}, "Artist": {}}
+
+dimension_columns = {
+    "Platform": ("platform_name", "platform_id"),
+    "Artist": ("artist_name", "artist_id")
+}
+
+# one bulk read-back per table
+def refresh_dimension_cache(cursor, tables=None):
+    for table in tables or dimension_columns:
+        name_column, id_column = dimension_columns[table]
+        cursor.execute(f"SELECT {name_column}, {id_column} FROM {table}")
+        dimension_cache[table] = {name.lower(): row_id for name, row_id in cursor.fetchall()}
+
+# forget everything, used when the database is dropped
+def clear_dimension_cache():
+    for table in dimension_cache:
+        dimension_cache[table] = {}
+
+# the ID of a name, None if it is not cached
+def dimension_id(table, name):
+    return dimension_cache[table].get(str(name).strip().lower())
+
+# same, but reads the table back once when the name is missing (e.g. a fresh session)
+def lookup_id(cursor, table, name):
+    if dimension_id(table, name) is None:
+        refresh_dimension_cache(cursor, [table])
+    return dimension_id(table, name)
+
+# give the names that are not cached yet a reserved ID and return their (id, name) rows
+# the caller writes the rows in bulk and checks them with resolve_dimension_ids
+def new_dimension_rows(cursor, table, names):
+    new_names = {}
+    for name in names:
+        if dimension_id(table, name) is None:
+            new_names.setdefault(name.lower(), name)
+    if not new_names:
+        return []
+
+    first_id = reserve_ids(cursor, table, dimension_columns[table][1], len(new_names))
+    rows = []
+    for row_id, (key, name) in enumerate(new_names.items(), first_id):
+        dimension_cache[table][key] = row_id
+        rows.append((row_id, name))
+    return rows
+
+
+# --- --- --- SHARED MUSICAL ATTRIBUTES --- --- ---
+
+
+# attributes_hash -> music_id of the vectors that are already stored, looked up for the given hashes only
+# (one frame or chunk at a time, nothing is kept between chunks)
+def stored_attribute_ids(cursor, hashes, batch_size=None):
+    batch_size = batch_size or BATCH_SIZE
+    stored = {}
+    for start in range(0, len(hashes), batch_size):
+        batch = hashes[start:start + batch_size]
+        cursor.execute(f"SELECT attributes_hash, music_id FROM MusicalAttributes WHERE attributes_hash IN ({', '.join(['%s'] * len(batch))})",
+                       batch)
+        stored.update(cursor.fetchall())
+    return stored
+
+# a hash of each row's attribute vector, the same values always give the same hash
+def attribute_hashes(spotify_df):
+    numeric_columns = [column for column in musical_columns if column not in ['key', 'mode']]
+    normalised = pd.concat([
+        spotify_df[numeric_columns].apply(pd.to_numeric, errors="coerce").astype("float64"),
+        spotify_df[['key', 'mode']].astype(str)
+    ], axis=1)
+    return pd.Series(pd.util.hash_pandas_object(normalised, index=False).values.view("int64"))
+
+# the MusicalAttributes rows to write for these CSV rows, and the music_id of every row
+# with DEDUPE_ATTRIBUTES each distinct vector is stored once under its hash, vectors that are
+# already stored are reused; without it every row gets its own attribute row, as in populate_tables
+def attribute_rows(cursor, spotify_df):
+    attributes = spotify_df[musical_columns].set_axis(table_columns["MusicalAttributes"][1:-1], axis=1).reset_index(drop=True)
+
+    if not DEDUPE_ATTRIBUTES:
+        music_start = reserve_ids(cursor, "MusicalAttributes", "music_id", len(attributes))
+        music_ids = range(music_start, music_start + len(attributes))
+        attributes.insert(0, "music_id", music_ids)
+        attributes["attributes_hash"] = None
+        return attributes, music_ids
+
+    attributes["attributes_hash"] = attribute_hashes(spotify_df)
+    music_ids = stored_attribute_ids(cursor, attributes["attributes_hash"].drop_duplicates().tolist())
+    new = attributes[~attributes["attributes_hash"].isin(music_ids.keys())].drop_duplicates("attributes_hash")
+    new = new.reset_index(drop=True)
+    if len(new):
+        music_start = reserve_ids(cursor, "MusicalAttributes", "music_id", len(new))
+        new.insert(0, "music_id", range(music_start, music_start + len(new)))
+        music_ids.update(zip(new["attributes_hash"].tolist(), new["music_id"].tolist()))
+    else:
+        new.insert(0, "music_id", pd.Series(dtype="int64"))
+
+    return new, attributes["attributes_hash"].map(music_ids).tolist()
+
+
+# --- --- --- BATCHED INGEST --- --- ---
+
+
+# which CSV column holds each (platform, metric type) value
+platform_metrics = {
+    "Spotify": {"in_playlists": "in_spotify_playlists", "in_charts": "in_spotify_charts", "streams": "streams"},
+    "Apple": {"in_playlists": "in_apple_playlists", "in_charts": "in_apple_charts"},
+    "Deezer": {"in_playlists": "in_deezer_playlists", "in_charts": "in_deezer_charts"},
+    "Shazam": {"in_charts": "in_shazam_charts"}
+}
+
+musical_columns = ['bpm', 'key', 'mode', 'danceability_%', 'valence_%', 'energy_%',
+                   'acousticness_%', 'instrumentalness_%', 'liveness_%', 'speechiness_%']
+
+# tables and columns, in the order they are written
+table_columns = {
+    "Platform": ["platform_id", "platform_name"],
+    "Artist": ["artist_id", "artist_name"],
+    "Track": ["track_id", "track_name", "artists_name", "release_year", "release_month", "release_day"],
+    "MusicalAttributes": ["music_id", "bpm", "key_signature", "mode", "danceability", "valence",
+                          "energy", "acousticness", "instrumentalness", "liveness", "speechiness", "attributes_hash"],
+    "TrackMusicalAttributes": ["track_id", "music_id"],
+    "TrackArtist": ["track_id", "artist_id"],
+    "StreamingMetric": ["platform_id", "track_id", "metric_type", "metric_value"],
+    "TrackFingerprint": ["track_id", "fingerprint"]
+}
+
+# same duplicate handling as populate_tables
+insert_statements = {
+    "Platform": ("INSERT IGNORE INTO", ""),
+    "Artist": ("INSERT IGNORE INTO", ""),
+    "Track": ("INSERT INTO", "ON DUPLICATE KEY UPDATE track_name = track_name"),
+    "MusicalAttributes": ("INSERT INTO", "ON DUPLICATE KEY UPDATE music_id = music_id"),
+    "TrackMusicalAttributes": ("INSERT INTO", ""),
+    "TrackArtist": ("INSERT IGNORE INTO", ""),
+    "StreamingMetric": ("INSERT IGNORE INTO", ""),
+    "TrackFingerprint": ("INSERT INTO", "ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint)")
+}
+
+# turn a DataFrame into plain python tuples, NaN becomes None (NULL)
+def frame_rows(frame):
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+# reserve `count` consecutive IDs for a table and return the first one
+# IdSequence hands out ranges atomically (UPDATE ... LAST_INSERT_ID(expr)), never below the
+# table's highest ID, so rows added through AUTO_INCREMENT ("row" mode) can't collide
+def reserve_ids(cursor, table, id_column, count):
+    cursor.execute("INSERT IGNORE INTO IdSequence (table_name, next_id) VALUES (%s, 1)", (table,))
+    cursor.execute(f"""
+        UPDATE IdSequence
+        SET next_id = LAST_INSERT_ID(GREATEST(next_id, (SELECT COALESCE(MAX({id_column}), 0) + 1 FROM {table})) + %s)
+        WHERE table_name = %s
+    """, (count, table))
+    cursor.execute("SELECT LAST_INSERT_ID()")
+    return cursor.fetchone()[0] - count
+
+# --- transform stage, whole columns at a time ---
+
+# "4,567" -> 4567 for whole columns, corrupt or missing values become 0 (same rule as populate_tables)
+def clean_metric_columns(frame):
+    cleaned = {}
+    for column in frame.columns:
+        values = frame[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values.astype(str).str.replace(",", "", regex=False), errors="coerce")
+        cleaned[column] = values.fillna(0).astype("int64")
+    return pd.DataFrame(cleaned, index=frame.index)
+
+# Track's natural key (name, artists, release date) as one string per row, compared the
+# way the unique key compares them: case-insensitive, surrounding spaces ignored
+def track_keys(names, artists, years, months, days):
+    parts = [names.astype(str).str.strip().str.lower(), artists.astype(str).str.strip().str.lower()]
+    dates = [pd.to_numeric(values, errors="coerce") for values in [years, months, days]]
+    parts += [values.where(values == values.round()).astype("Int64").astype(str) for values in dates] # a fraction is missing, as in apply_csv_schema
+    return parts[0].str.cat(parts[1:], sep="\x1f").reset_index(drop=True)
+
+def csv_track_keys(spotify_df):
+    return track_keys(spotify_df['track_name'], spotify_df['artist(s)_name'], spotify_df['released_year'],
+                      spotify_df['released_month'], spotify_df['released_day'])
+
+# everything the database keeps from a CSV row besides the unique key, normalised so the same
+# values compare (and hash) the same whatever dtype pandas picked
+def normalised_row_values(spotify_df):
+    metric_columns = [column for metrics in platform_metrics.values() for column in metrics.values()]
+    numeric_columns = [column for column in musical_columns if column not in ['key', 'mode']]
+    return pd.concat([
+        clean_metric_columns(spotify_df[metric_columns]).astype("float64"),
+        spotify_df[numeric_columns].apply(pd.to_numeric, errors="coerce").astype("float64"),
+        spotify_df[['key', 'mode']].astype(str)
+    ], axis=1).reset_index(drop=True)
+
+# a hash of everything the database keeps from a CSV row, used to spot changed tracks
+def row_fingerprints(spotify_df):
+    return pd.Series(pd.util.hash_pandas_object(normalised_row_values(spotify_df), index=False).values.view("int64"))
+
+# the loaded tables read back with the CSV's column names, one row per track
+def stored_csv_rows(cursor):
+    cursor.execute("""
+        SELECT T.track_id, T.track_name, T.artists_name, T.release_year, T.release_month, T.release_day,
+               M.bpm, M.key_signature, M.mode, M.danceability, M.valence, M.energy,
+               M.acousticness, M.instrumentalness, M.liveness, M.speechiness
+        FROM Track T
+        JOIN TrackMusicalAttributes TMA ON T.track_id = TMA.track_id
+        JOIN MusicalAttributes M ON TMA.music_id = M.music_id
+    """)
+    stored = pd.DataFrame(cursor.fetchall(), columns=['track_id', 'track_name', 'artist(s)_name', 'released_year',
+                                                      'released_month', 'released_day'] + musical_columns)
+    stored[['key', 'mode']] = stored[['key', 'mode']].astype(object).where(stored[['key', 'mode']].notna(), np.nan)
+
+    cursor.execute("""
+        SELECT SM.track_id, P.platform_name, SM.metric_type, SM.metric_value
+        FROM StreamingMetric SM JOIN Platform P ON SM.platform_id = P.platform_id
+    """)
+    metrics = pd.DataFrame(cursor.fetchall(), columns=["track_id", "platform", "metric_type", "metric_value"])
+    metrics["column"] = [platform_metrics.get(platform, {}).get(metric_type)
+                         for platform, metric_type in zip(metrics["platform"], metrics["metric_type"])]
+    wide = metrics.pivot_table(index="track_id", columns="column", values="metric_value", aggfunc="first")
+    return stored.join(wide, on="track_id")
+
+# do the loaded tables hold what the untyped parser (read_csv's own dtypes) reads from the file at path?
+# one row per column: tracks compared and how many of them differ
+def schema_parity(cursor, path):
+    with open(path, "rb") as csv_file:
+        encoding = detect_encoding(csv_file.read(ENCODING_SAMPLE_BYTES))
+    untyped = unique_tracks(sanitize_text_columns(pd.read_csv(path, encoding=encoding, encoding_errors='replace'), encoding))
+    stored = stored_csv_rows(cursor)
+    for column in [column for metrics in platform_metrics.values() for column in metrics.values()]:
+        if column not in stored:
+            stored[column] = np.nan
+
+    expected = normalised_row_values(untyped).set_axis(csv_track_keys(untyped))
+    actual = normalised_row_values(stored).set_axis(csv_track_keys(stored))
+    report = [("tracks", len(expected), int((~expected.index.isin(actual.index)).sum()))] # missing from the database
+    actual = actual[~actual.index.duplicated()].reindex(expected.index)
+    for column in expected.columns:
+        same = (expected[column] == actual[column]) | (expected[column].isna() & actual[column].isna())
+        report.append((column, len(expected), int((~same).sum())))
+    report = pd.DataFrame(report, columns=["Column", "Rows", "Different"])
+    report["Parity"] = np.where(report["Different"] == 0, "ok", "MISMATCH")
+    return report
+
+# drop rows without artists and tracks repeated in the same frame (the unique key would reject them anyway),
+# repeats of tracks already in the database are dropped by keep_written_tracks
+def unique_tracks(spotify_df):
+    spotify_df = spotify_df[spotify_df['artist(s)_name'].notna()]
+    keep = ~csv_track_keys(spotify_df).duplicated()
+    return spotify_df[keep.values]
+
+# one (track_id, artist_name) row per artist of every track
+def explode_artists(artist_names, track_ids):
+    exploded = pd.DataFrame({"track_id": track_ids, "artist_name": artist_names.str.split(",").values}).explode("artist_name")
+    exploded["artist_name"] = exploded["artist_name"].str.strip()
+    return exploded[exploded["artist_name"].notna() & (exploded["artist_name"] != "")]
+
+# melt the in_*_playlists, in_*_charts and streams columns into the long StreamingMetric layout
+def melt_streaming_metrics(spotify_df, track_ids):
+    metric_columns = {column: (platform, metric_type)
+                      for platform, metrics in platform_metrics.items()
+                      for metric_type, column in metrics.items()}
+
+    wide = clean_metric_columns(spotify_df[list(metric_columns)])
+    wide.index = pd.RangeIndex(len(wide))
+    wide.insert(0, "track_id", track_ids)
+    long = wide.melt(id_vars="track_id", var_name="column", value_name="metric_value")
+
+    long["platform_id"] = long["column"].map({column: dimension_id("Platform", platform)
+                                              for column, (platform, _) in metric_columns.items()})
+    long["metric_type"] = long["column"].map({column: metric_type
+                                              for column, (_, metric_type) in metric_columns.items()})
+    return long[table_columns["StreamingMetric"]]
+
+# build every table as a DataFrame, with all IDs assigned here instead of by MySQL
+# nothing is read back after an insert, so every table can be written in bulk
+def build_table_frames(cursor, spotify_df):
+    spotify_df = unique_tracks(spotify_df)
+
+    # names already in the database keep their IDs, the cache is only read when empty
+    if not dimension_cache["Platform"]:
+        refresh_dimension_cache(cursor)
+
+    # one reserved range per table, track i gets track_start + i
+    track_start = reserve_ids(cursor, "Track", "track_id", len(spotify_df))
+    track_ids = range(track_start, track_start + len(spotify_df))
+
+    track_artists = explode_artists(spotify_df['artist(s)_name'], track_ids)
+
+    frames = {}
+
+    # every UNIQUE platform and artist, once, in the order they first appear
+    for table, names in [("Platform", platforms), ("Artist", track_artists["artist_name"].tolist())]:
+        frames[table] = pd.DataFrame(new_dimension_rows(cursor, table, names), columns=table_columns[table])
+
+    frames["Track"] = spotify_df[['track_name', 'artist(s)_name', 'released_year', 'released_month', 'released_day']].set_axis(
+        table_columns["Track"][1:], axis=1).reset_index(drop=True)
+    frames["Track"].insert(0, "track_id", track_ids)
+
+    frames["MusicalAttributes"], music_ids = attribute_rows(cursor, spotify_df)
+    frames["TrackMusicalAttributes"] = pd.DataFrame({"track_id": track_ids, "music_id": music_ids})
+
+    track_artists["artist_id"] = track_artists["artist_name"].str.lower().map(dimension_cache["Artist"])
+    frames["TrackArtist"] = track_artists[table_columns["TrackArtist"]].drop_duplicates().reset_index(drop=True)
+
+    frames["StreamingMetric"] = melt_streaming_metrics(spotify_df, track_ids)
+    frames["TrackFingerprint"] = pd.DataFrame({"track_id": track_ids, "fingerprint": row_fingerprints(spotify_df)})
+    return frames
+
+# write rows with multi-row INSERT statements, batch_size rows per statement
+# statement ends with "VALUES", suffix is anything that goes after the row list
+def insert_batches(cursor, statement, rows, batch_size=None, suffix=""):
+    batch_size = batch_size or BATCH_SIZE
+    if not rows:
+        return
+
+    placeholders = "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.execute(f"{statement} {', '.join([placeholders] * len(batch))} {suffix}",
+                       [value for row in batch for value in row])
+
+# the frame column that points at each dimension table
+dimension_references = {"Platform": ("StreamingMetric", "platform_id"), "Artist": ("TrackArtist", "artist_id")}
+
+# a new name the database already had under another spelling was turned away by INSERT IGNORE
+# (MySQL's collation ignores accents too: "Beyonce" is "Beyoncé"), its reserved ID is replaced by the one
+# the database has, so the rows pointing at it are not lost to the foreign key
+def resolve_dimension_ids(cursor, table, frames):
+    name_column, id_column = dimension_columns[table]
+    reserved = frames[table][id_column]
+    if reserved.empty:
+        return
+    cursor.execute(f"SELECT {id_column} FROM {table} WHERE {id_column} BETWEEN %s AND %s", (int(reserved.min()), int(reserved.max())))
+    written = {row[0] for row in cursor.fetchall()}
+    if len(written) == len(reserved):
+        return
+
+    remap = {}
+    for row_id, name in zip(reserved.tolist(), frames[table][name_column].tolist()):
+        if row_id not in written:
+            cursor.execute(f"SELECT {id_column} FROM {table} WHERE {name_column} = %s", (name,)) # compared with the column's collation
+            found = cursor.fetchone()
+            remap[row_id] = found[0] if found else None
+            if found:
+                dimension_cache[table][name.lower()] = found[0]
+            else:
+                dimension_cache[table].pop(name.lower(), None)
+
+    frame, column = dimension_references[table]
+    frames[frame][column] = frames[frame][column].map(lambda row_id: remap.get(row_id, row_id))
+    frames[frame] = frames[frame].dropna(subset=[column]).astype({column: "int64"}).drop_duplicates().reset_index(drop=True)
+
+# tracks the unique key turned away (a repeat of a track an earlier chunk or load wrote) are not in Track,
+# their rows are removed from the frames that are written after it, so nothing is kept between chunks
+def keep_written_tracks(cursor, frames):
+    track_ids = frames["Track"]["track_id"]
+    if track_ids.empty:
+        return
+    cursor.execute("SELECT track_id FROM Track WHERE track_id BETWEEN %s AND %s", (int(track_ids.min()), int(track_ids.max())))
+    written = [row[0] for row in cursor.fetchall()]
+    if len(written) == len(track_ids):
+        return
+
+    for table in ["Track", "TrackMusicalAttributes", "TrackArtist", "StreamingMetric", "TrackFingerprint"]:
+        frames[table] = frames[table][frames[table]["track_id"].isin(written)].reset_index(drop=True)
+    # attribute rows that only the dropped tracks used
+    used = frames["TrackMusicalAttributes"]["music_id"]
+    frames["MusicalAttributes"] = frames["MusicalAttributes"][frames["MusicalAttributes"]["music_id"].isin(used)].reset_index(drop=True)
+
+# write the output of build_table_frames, table by table
+# timings, if given, gets the milliseconds spent on each table (used by the benchmark suite)
+def write_table_frames(cursor, frames, batch_size=None, timings=None):
+    for table, columns in table_columns.items():
+        start = time.perf_counter()
+        verb, suffix = insert_statements[table]
+        with call_site(f"load.{table}"):
+            insert_batches(cursor, f"{verb} {table} ({', '.join(columns)}) VALUES", frame_rows(frames[table]), batch_size, suffix)
+            if table == "Track":
+                keep_written_tracks(cursor, frames)
+            elif table in dimension_columns:
+                resolve_dimension_ids(cursor, table, frames)
+        if timings is not None:
+            timings[table] = (time.perf_counter() - start) * 1000
+
+# function to populate ALL tables with multi-row INSERTs ("batched" mode, the default)
+def populate_tables_batched(cursor, batch_size=None):
+    frames = build_table_frames(cursor, read_spotify_csv(filepath))
+    write_table_frames(cursor, frames, batch_size)
+    refresh_dimension_cache(cursor)
+    record_load(cursor, filepath, dataset_file_hash(filepath), len(frames["Track"]))
+
+
+# --- --- --- STREAMING INGEST --- --- ---
+
+
+# read the CSV chunk by chunk, each chunk cleaned on its own so the whole file is never in memory
+# a file can't be re-read once chunks are written, so undecodable bytes become "?" instead of
+# switching to cp1252 halfway through
+def read_spotify_chunks(csv_file, chunk_size=None):
+    encoding = detect_encoding(csv_file.read(ENCODING_SAMPLE_BYTES))
+    csv_file.seek(0)
+    for chunk in pd.read_csv(csv_file, encoding=encoding, encoding_errors='replace', chunksize=chunk_size or CHUNK_SIZE,
+                             **csv_read_options):
+        yield apply_csv_schema(sanitize_text_columns(chunk, encoding))
+
+# function to populate ALL tables one chunk at a time ("streaming" mode), peak memory stays at about one chunk
+def populate_tables_streaming(cursor, chunk_size=None, batch_size=None):
+    total = os.path.getsize(filepath)
+    row_count = 0
+
+    with open(filepath, "rb") as csv_file, Progress() as progress:
+        task = progress.add_task(f"[green]Loading {os.path.basename(filepath)}...", total=total)
+
+        for chunk in read_spotify_chunks(csv_file, chunk_size):
+            frames = build_table_frames(cursor, chunk)
+            write_table_frames(cursor, frames, batch_size) # a track repeated from an earlier chunk is skipped here
+            row_count += len(frames["Track"])
+            progress.update(task, completed=min(csv_file.tell(), total))
+
+        progress.update(task, completed=total)
+    refresh_dimension_cache(cursor)
+    record_load(cursor, filepath, dataset_file_hash(filepath), row_count)
+
+
+# --- --- --- BULK LOAD (LOAD DATA LOCAL INFILE) --- --- ---
+
+
+# MySQL error codes meaning LOAD DATA LOCAL is switched off on the server or the client
+local_infile_errors = {1148, 2068, 3948}
+
+# a column in LOAD DATA's default text format: \N is NULL, backslash escapes tabs and newlines
+def tsv_column(values):
+    text = values.astype(str)
+    if pd.api.types.is_string_dtype(values):
+        for char, escaped in [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]:
+            text = text.str.replace(char, escaped, regex=False)
+    return text.mask(values.isna(), "\\N")
+
+# the whole table is joined into lines column by column, not row by row
+def write_staging_file(path, frame):
+    columns = [tsv_column(frame[column]) for column in frame.columns]
+    lines = columns[0].str.cat(columns[1:], sep="\t") if len(columns) > 1 else columns[0]
+    with open(path, "w", encoding="utf-8", newline="\n") as staging_file:
+        if len(lines):
+            staging_file.write("\n".join(lines) + "\n")
+
+# is LOAD DATA LOCAL INFILE allowed by the server?
+def local_infile_enabled(cursor):
+    cursor.execute("SHOW GLOBAL VARIABLES LIKE 'local_infile'")
+    setting = cursor.fetchone()
+    return bool(setting) and str(setting[1]).upper() in ["ON", "1"]
+
+# function to populate ALL tables with MySQL's bulk loader ("infile" mode)
+# every table is staged as a TSV file first, falls back to "batched" mode when local_infile is disabled
+def populate_tables_infile(cursor, staging_dir=None):
+    if BACKEND == "sqlite":
+        print("[blue]LOAD DATA is MySQL only, loading with batched INSERTs instead.[/blue]")
+        return populate_tables_batched(cursor)
+    if not local_infile_enabled(cursor):
+        print("[blue]local_infile is disabled on the server, loading with batched INSERTs instead.[/blue]")
+        return populate_tables_batched(cursor)
+
+    staging_dir = staging_dir or STAGING_DIR
+    temporary = staging_dir is None
+    staging_dir = staging_dir or tempfile.mkdtemp(prefix="spotify_staging_")
+    os.makedirs(staging_dir, exist_ok=True)
+
+    try:
+        frames = build_table_frames(cursor, read_spotify_csv(filepath))
+
+        for table, columns in table_columns.items():
+            path = os.path.join(staging_dir, f"{table}.tsv")
+            write_staging_file(path, frames[table])
+            try:
+                with call_site(f"load.{table}"):
+                    cursor.execute(f"""
+                        LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table}
+                        CHARACTER SET utf8mb4
+                        FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+                        ({", ".join(columns)})
+                    """, (path,))
+                    if table == "Track":
+                        keep_written_tracks(cursor, frames)
+                    elif table in dimension_columns:
+                        resolve_dimension_ids(cursor, table, frames)
+            except mysql.connector.Error as err:
+                # the client can refuse LOCAL files too, nothing is loaded yet when Platform fails
+                if err.errno in local_infile_errors and table == "Platform":
+                    print("[blue]LOAD DATA LOCAL INFILE was refused, loading with batched INSERTs instead.[/blue]")
+                    clear_dimension_cache() # the staged Platform and Artist rows were never written
+                    return populate_tables_batched(cursor)
+                raise
+        refresh_dimension_cache(cursor)
+        record_load(cursor, filepath, dataset_file_hash(filepath), len(frames["Track"]))
+    finally:
+        if temporary:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+# --- --- --- INCREMENTAL LOAD --- --- ---
+
+
+# content hash of the CSV file, read in blocks
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as csv_file:
+        for block in iter(lambda: csv_file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def record_load(cursor, path, file_hash, row_count):
+    cursor.execute("INSERT INTO LoadMetadata (file_path, file_hash, row_count) VALUES (%s, %s, %s)",
+                   (os.path.abspath(path), file_hash, row_count))
+
+# hash of the last file that was loaded, None on an empty database
+def last_loaded_hash(cursor):
+    cursor.execute("SELECT file_hash FROM LoadMetadata ORDER BY load_id DESC LIMIT 1")
+    last_load = cursor.fetchone()
+    return last_load[0] if last_load else None
+
+# function to bring the tables up to date without dropping them ("incremental" mode)
+# nothing happens if the file is unchanged, otherwise new tracks are inserted and changed
+# tracks get their attributes and metrics upserted; returns False when the load was skipped
+def populate_tables_incremental(cursor, batch_size=None):
+    file_hash = dataset_file_hash(filepath)
+    if last_loaded_hash(cursor) == file_hash:
+        print("[blue]The file has not changed since the last load, nothing to reload.[/blue]")
+        return False
+
+    spotify_df = unique_tracks(read_spotify_csv(filepath)).reset_index(drop=True)
+    fingerprints = row_fingerprints(spotify_df)
+
+    # what is already loaded, matched on the natural key
+    cursor.execute("""
+        SELECT T.track_id, T.track_name, T.artists_name, T.release_year, T.release_month, T.release_day, TF.fingerprint
+        FROM Track T
+        LEFT JOIN TrackFingerprint TF ON T.track_id = TF.track_id
+    """)
+    loaded = pd.DataFrame(cursor.fetchall(), columns=["track_id", "track_name", "artists_name", "release_year",
+                                                      "release_month", "release_day", "fingerprint"], dtype=object)
+    loaded_keys = track_keys(loaded["track_name"], loaded["artists_name"], loaded["release_year"],
+                             loaded["release_month"], loaded["release_day"])
+    matched = pd.DataFrame({"key": csv_track_keys(spotify_df)}).merge(
+        loaded[["track_id", "fingerprint"]].assign(key=loaded_keys).drop_duplicates("key"), on="key", how="left")
+
+    new = matched["track_id"].isna().values
+    changed = ~new & (matched["fingerprint"].astype("Int64") != fingerprints).fillna(True).values
+
+    # new tracks go through the normal bulk path
+    if new.any():
+        write_table_frames(cursor, build_table_frames(cursor, spotify_df[new]), batch_size)
+
+    # changed tracks keep their IDs, their attribute rows and metrics are overwritten
+    if changed.any():
+        changed_df = spotify_df[changed]
+        track_ids = matched.loc[changed, "track_id"].astype("int64").tolist()
+
+        if DEDUPE_ATTRIBUTES:
+            # shared attribute rows are never edited, the track is pointed at the row for its new vector
+            attributes, music_ids = attribute_rows(cursor, changed_df)
+            verb, suffix = insert_statements["MusicalAttributes"]
+            insert_batches(cursor, f"{verb} MusicalAttributes ({', '.join(table_columns['MusicalAttributes'])}) VALUES",
+                           frame_rows(attributes), batch_size, suffix)
+            batch_size = batch_size or BATCH_SIZE
+            for start in range(0, len(track_ids), batch_size):
+                batch = track_ids[start:start + batch_size]
+                cursor.execute(f"DELETE FROM TrackMusicalAttributes WHERE track_id IN ({', '.join(['%s'] * len(batch))})", batch)
+            insert_batches(cursor, "INSERT INTO TrackMusicalAttributes (track_id, music_id) VALUES",
+                           list(zip(track_ids, music_ids)), batch_size)
+        else:
+            # every track has its own attribute row, which is overwritten in place
+            cursor.execute("SELECT track_id, music_id FROM TrackMusicalAttributes")
+            music_ids = dict(cursor.fetchall())
+            attributes = changed_df[musical_columns].set_axis(table_columns["MusicalAttributes"][1:-1], axis=1).reset_index(drop=True)
+            attributes.insert(0, "music_id", [music_ids.get(track_id) for track_id in track_ids])
+            attributes = attributes[attributes["music_id"].notna()]
+            insert_batches(cursor, f"INSERT INTO MusicalAttributes ({', '.join(table_columns['MusicalAttributes'][:-1])}) VALUES",
+                           frame_rows(attributes), batch_size,
+                           "ON DUPLICATE KEY UPDATE " + ", ".join(f"{column} = VALUES({column})"
+                                                                  for column in table_columns["MusicalAttributes"][1:-1]))
+
+        insert_batches(cursor, f"INSERT INTO StreamingMetric ({', '.join(table_columns['StreamingMetric'])}) VALUES",
+                       frame_rows(melt_streaming_metrics(changed_df, track_ids)), batch_size,
+                       "ON DUPLICATE KEY UPDATE metric_value = VALUES(metric_value)")
+
+        verb, suffix = insert_statements["TrackFingerprint"]
+        insert_batches(cursor, f"{verb} TrackFingerprint (track_id, fingerprint) VALUES",
+                       list(zip(track_ids, fingerprints[changed].tolist())), batch_size, suffix)
+
+    refresh_dimension_cache(cursor)
+    record_load(cursor, filepath, file_hash, len(spotify_df))
+    print(f"[blue]Incremental load: {int(new.sum())} new, {int(changed.sum())} changed, "
+          f"{int(len(spotify_df) - new.sum() - changed.sum())} unchanged tracks.[/blue]")
+
+
+# loaders that can be picked with LOAD_MODE
+loaders = {
+    "row": populate_tables,
+    "batched": populate_tables_batched,
+    "infile": populate_tables_infile,
+    "streaming": populate_tables_streaming,
+    "incremental": populate_tables_incremental
+}
 
 
 # --- --- --- see the comments below for more code used though the early stages for "checks" and "validation" --- --- ---
@@ -290,8 +1601,8 @@ query1 = """
                 WHEN T.release_month IN (9, 10, 11) THEN 'Fall'
             END AS season,
             ROUND(AVG(MA.bpm), 4),
-            ROUND(SUM(CASE WHEN MA.mode = 'Major' THEN 1 ELSE 0 END) / COUNT(*) * 100) AS percent_major,
-            ROUND(SUM(CASE WHEN MA.mode = 'Minor' THEN 1 ELSE 0 END) / COUNT(*) * 100) AS percent_minor,
+            ROUND(100.0 * SUM(CASE WHEN MA.mode = 'Major' THEN 1 ELSE 0 END) / COUNT(*)) AS percent_major,
+            ROUND(100.0 * SUM(CASE WHEN MA.mode = 'Minor' THEN 1 ELSE 0 END) / COUNT(*)) AS percent_minor,
             ROUND(AVG(MA.valence)) AS avg_valence,
             ROUND(AVG(MA.energy)) AS avg_energy,
             ROUND(AVG(MA.danceability)) AS avg_danceability,
@@ -305,117 +1616,54 @@ query1 = """
         ORDER BY FIELD(season, 'Winter', 'Spring', 'Summer', 'Fall');
 """
 
+# the per-platform averages and standard deviations come from PlatformStats (see refresh_platform_stats)
 query2 = """
-        WITH MetricStats AS (
-            SELECT 
-                P.platform_name,
-                AVG(CASE WHEN SM.metric_type = 'in_playlists' THEN SM.metric_value END) AS avg_playlists,
-                STDDEV(CASE WHEN SM.metric_type = 'in_playlists' THEN SM.metric_value END) AS stddev_playlists,
-
-                AVG(CASE WHEN SM.metric_type = 'in_charts' THEN 1.0 / SM.metric_value END) AS avg_inverted_chart_rank,
-                STDDEV(CASE WHEN SM.metric_type = 'in_charts' THEN 1.0 / SM.metric_value END) AS stddev_inverted_chart_rank,
-
-                AVG(CASE WHEN P.platform_name = 'Spotify' AND SM.metric_type = 'streams' THEN SM.metric_value END) AS avg_spotify_streams,
-                STDDEV(CASE WHEN P.platform_name = 'Spotify' AND SM.metric_type = 'streams' THEN SM.metric_value END) AS stddev_spotify_streams
-            FROM StreamingMetric SM
-            JOIN Platform P ON SM.platform_id = P.platform_id
-            GROUP BY P.platform_name
-        )
-
         SELECT 
             A.artist_name,
-            -- Weighted playlist counts normalized by standard deviation
-            ROUND(SUM(CASE WHEN P.platform_name = 'Spotify' AND SM.metric_type = 'in_playlists' 
-                    THEN (SM.metric_value / (SELECT avg_playlists FROM MetricStats WHERE platform_name = 'Spotify')) 
-                        * (1 / (SELECT stddev_playlists FROM MetricStats WHERE platform_name = 'Spotify')) ELSE 0 END) +
-            SUM(CASE WHEN P.platform_name = 'Apple' AND SM.metric_type = 'in_playlists' 
-                    THEN (SM.metric_value / (SELECT avg_playlists FROM MetricStats WHERE platform_name = 'Apple')) 
-                        * (1 / (SELECT stddev_playlists FROM MetricStats WHERE platform_name = 'Apple')) ELSE 0 END) +
-            SUM(CASE WHEN P.platform_name = 'Deezer' AND SM.metric_type = 'in_playlists' 
-                    THEN (SM.metric_value / (SELECT avg_playlists FROM MetricStats WHERE platform_name = 'Deezer')) 
-                        * (1 / (SELECT stddev_playlists FROM MetricStats WHERE platform_name = 'Deezer')) ELSE 0 END) +
-            SUM(CASE WHEN P.platform_name = 'Shazam' AND SM.metric_type = 'in_playlists' 
-                    THEN (SM.metric_value / (SELECT avg_playlists FROM MetricStats WHERE platform_name = 'Shazam')) 
-                        * (1 / (SELECT stddev_playlists FROM MetricStats WHERE platform_name = 'Shazam')) ELSE 0 END) 
-            +
-
-            -- Weighted inverted chart ranks normalized by standard deviation
-            SUM(CASE WHEN P.platform_name = 'Spotify' AND SM.metric_type = 'in_charts' 
-                    THEN ((1.0 / SM.metric_value) / (SELECT avg_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Spotify')) 
-                        * (1 / (SELECT stddev_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Spotify')) ELSE 0 END) +
-            SUM(CASE WHEN P.platform_name = 'Apple' AND SM.metric_type = 'in_charts' 
-                    THEN ((1.0 / SM.metric_value) / (SELECT avg_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Apple')) 
-                        * (1 / (SELECT stddev_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Apple')) ELSE 0 END) +
-            SUM(CASE WHEN P.platform_name = 'Deezer' AND SM.metric_type = 'in_charts' 
-                    THEN ((1.0 / SM.metric_value) / (SELECT avg_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Deezer')) 
-                        * (1 / (SELECT stddev_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Deezer')) ELSE 0 END) +
-            SUM(CASE WHEN P.platform_name = 'Shazam' AND SM.metric_type = 'in_charts' 
-                    THEN ((1.0 / SM.metric_value) / (SELECT avg_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Shazam')) 
-                        * (1 / (SELECT stddev_inverted_chart_rank FROM MetricStats WHERE platform_name = 'Shazam')) ELSE 0 END) 
-            +
-
-            -- Weighted streams for Spotify normalized by standard deviation
-            SUM(CASE WHEN P.platform_name = 'Spotify' AND SM.metric_type = 'streams' 
-                    THEN (SM.metric_value / (SELECT avg_spotify_streams FROM MetricStats WHERE platform_name = 'Spotify')) 
-                        * (1 / (SELECT stddev_spotify_streams FROM MetricStats WHERE platform_name = 'Spotify')) ELSE 0 END), 2) AS weighted_score
-        FROM Track T
-        JOIN StreamingMetric SM ON T.track_id = SM.track_id
-        JOIN Platform P ON SM.platform_id = P.platform_id
-        JOIN TrackArtist TA ON T.track_id = TA.track_id
+            -- Weighted playlist counts, inverted chart ranks and Spotify streams, normalized by standard deviation
+            ROUND(SUM(CASE SM.metric_type
+                    WHEN 'in_playlists' THEN (SM.metric_value / PS.avg_playlists) * (1 / PS.stddev_playlists)
+                    WHEN 'in_charts' THEN ((1.0 / NULLIF(SM.metric_value, 0)) / PS.avg_inverted_chart_rank) * (1 / PS.stddev_inverted_chart_rank)
+                    WHEN 'streams' THEN (SM.metric_value / PS.avg_streams) * (1 / PS.stddev_streams)
+                END), 2) AS weighted_score
+        FROM StreamingMetric SM
+        JOIN PlatformStats PS ON SM.platform_id = PS.platform_id
+        JOIN TrackArtist TA ON SM.track_id = TA.track_id
         JOIN Artist A ON TA.artist_id = A.artist_id
         GROUP BY A.artist_name
         ORDER BY weighted_score DESC
         LIMIT 10;
 """
 
+# danceability_range is a stored column of MusicalAttributes, the bucket statistics are window
+# functions over the same rows, so the table is scanned once and nothing is rejoined
 query3 = """
-        WITH DanceabilityStats AS (
+        WITH PlaylistDeviations AS (
             SELECT 
-                CASE
-                    WHEN MA.danceability BETWEEN 0 AND 30 THEN '0-30%'
-                    WHEN MA.danceability BETWEEN 31 AND 50 THEN '31-50%'
-                    WHEN MA.danceability BETWEEN 51 AND 60 THEN '51-60%'
-                    WHEN MA.danceability BETWEEN 61 AND 80 THEN '61-80%'
-                    ELSE '81-100%'
-                END AS danceability_range,
-                ROUND(AVG(SM.metric_value)) AS avg_playlists,
-                CAST(ROUND(STDDEV(SM.metric_value))AS SIGNED) AS stddev_playlists
-            FROM MusicalAttributes MA
-            JOIN TrackMusicalAttributes TMA ON MA.music_id = TMA.music_id
-            JOIN StreamingMetric SM ON TMA.track_id = SM.track_id
-            JOIN Platform P ON SM.platform_id = P.platform_id
+                T.track_name,  -- Get the track name from the Track table
+                MA.danceability,
+                MA.danceability_range,
+                SM.metric_value,
+                ROUND(AVG(SM.metric_value) OVER danceability_bucket) AS avg_playlists,
+                CAST(ROUND(STDDEV(SM.metric_value) OVER danceability_bucket) AS SIGNED) AS stddev_playlists
+            FROM StreamingMetric SM
+            JOIN TrackMusicalAttributes TMA ON SM.track_id = TMA.track_id
+            JOIN MusicalAttributes MA ON TMA.music_id = MA.music_id
+            JOIN Track T ON SM.track_id = T.track_id
             WHERE SM.platform_id = 1 AND SM.metric_type = 'in_playlists'
-            GROUP BY danceability_range
+            WINDOW danceability_bucket AS (PARTITION BY MA.danceability_range)
         )
 
         SELECT 
-            T.track_name,  -- Get the track name from the Track table
-            MA.danceability AS danceability_percentage,
-            CASE
-                WHEN MA.danceability BETWEEN 0 AND 30 THEN '0-30%'
-                WHEN MA.danceability BETWEEN 31 AND 50 THEN '31-50%'
-                WHEN MA.danceability BETWEEN 51 AND 60 THEN '51-60%'
-                WHEN MA.danceability BETWEEN 61 AND 80 THEN '61-80%'
-                ELSE '81-100%'
-            END AS danceability_range,
-            ROUND(SM.metric_value, 2) AS actual_playlists,
-            ds.avg_playlists,
-            ds.stddev_playlists,
-            ROUND((SM.metric_value - ds.avg_playlists) / ds.stddev_playlists, 2) AS deviation
-        FROM MusicalAttributes MA
-        JOIN TrackMusicalAttributes TMA ON MA.music_id = TMA.music_id
-        JOIN StreamingMetric SM ON TMA.track_id = SM.track_id
-        JOIN DanceabilityStats ds ON 
-            CASE
-                WHEN MA.danceability BETWEEN 0 AND 30 THEN '0-30%'
-                WHEN MA.danceability BETWEEN 31 AND 50 THEN '31-50%'
-                WHEN MA.danceability BETWEEN 51 AND 70 THEN '51-60%'
-                WHEN MA.danceability BETWEEN 71 AND 90 THEN '61-80%'
-                ELSE '81-100%'
-            END = ds.danceability_range
-        JOIN Track T ON TMA.track_id = T.track_id  -- Join to get track name
-        WHERE SM.platform_id = 1 AND SM.metric_type = 'in_playlists'
-        AND ABS((SM.metric_value - ds.avg_playlists) / ds.stddev_playlists) > 2.5  -- Flagging significant deviations
+            track_name,
+            danceability AS danceability_percentage,
+            danceability_range,
+            ROUND(metric_value, 2) AS actual_playlists,
+            avg_playlists,
+            stddev_playlists,
+            ROUND((metric_value - avg_playlists) / stddev_playlists, 2) AS deviation
+        FROM PlaylistDeviations
+        WHERE ABS((metric_value - avg_playlists) / stddev_playlists) > 2.5  -- Flagging significant deviations
         ORDER BY deviation DESC;
 """
 
@@ -605,22 +1853,29 @@ def get_user_preferences():
         rap = input("Your Choice: ").strip().lower()
     return {"mood": mood, "dance": dance, "lyrics": lyrics, "acoustic": acoustic, "rap": rap}
 
-def generate_playlist(preferences):
-        
-    valence, bpm, mode, dance, energy = "=", "=", "Major", "=", "="
-    if preferences["dance"] in ["yes", "y"]:
-        valence, bpm, dance, energy = ">=", ">=", ">=", ">="
-    elif preferences["mood"] == 0 and preferences["dance"] in ["no", "n"]:
-        valence, bpm, mode, dance, energy = "<=", "<=", "Minor", "<=", "<="
-    
-    elif preferences["mood"] == 1 and preferences["dance"] in ["no", "n"]:
-        valence, bpm, mode, dance, energy = ">=", "<=", "Major", "<=", "<="
-
-    inst_range = [0, 30] if preferences["lyrics"] in ["lyrics", "l"] else [70, 100] if preferences["lyrics"] in ["instrumentals", "i"] else [30, 70]
-    rap = "DESC" if preferences["rap"] in ["yes", "y"] else "ASC"
-    acoustic = ">=" if preferences["acoustic"] in ["acoustic", "a"] else "<="
-
-    query8 = f"""
+# every answer get_user_preferences accepts, one value per choice (48 combinations)
+def preference_combinations():
+    return [{"mood": mood, "dance": dance, "lyrics": lyrics, "acoustic": acoustic, "rap": rap}
+            for mood in [1, 0]
+            for dance in ["y", "n"]
+            for lyrics in ["l", "i", "b"]
+            for acoustic in ["e", "a"]
+            for rap in ["y", "n"]]
+
+# the same preferences typed in full ("yes", "lyrics") or as one letter give the same key
+def preference_key(preferences):
+    return (preferences["mood"], preferences["dance"][0], preferences["lyrics"][0],
+            preferences["acoustic"][0], preferences["rap"][0])
+
+# bigger than any attribute value (percentages, BPM), stands in for "no bound"
+playlist_unbounded = 10 ** 9
+
+# (low, high) for "ma.column BETWEEN low AND high", the same rows as "ma.column <operator> value"
+def comparison_bounds(operator, value):
+    return {"=": (value, value), ">=": (value, playlist_unbounded), "<=": (-playlist_unbounded, value)}[operator]
+
+# the playlist SQL, the comparisons and the sort direction are parameters (see playlist_params)
+playlist_statement = """
             SELECT 
                 t.track_name,
                 GROUP_CONCAT(a.artist_name SEPARATOR ', ') AS artists,
@@ -636,21 +1891,41 @@ def generate_playlist(preferences):
             JOIN 
                 MusicalAttributes ma ON tma.music_id = ma.music_id
             WHERE 
-                ma.valence {valence} 50 
-                AND ma.bpm {bpm} 120
-                AND ma.energy {energy} 70 
-                AND ma.danceability {dance} 60 
-                AND ma.instrumentalness BETWEEN {inst_range[0]} AND {inst_range[1]}
-                AND ma.acousticness {acoustic} 50 
-                AND ma.mode = '{mode}'
+                ma.valence BETWEEN %s AND %s
+                AND ma.bpm BETWEEN %s AND %s
+                AND ma.energy BETWEEN %s AND %s
+                AND ma.danceability BETWEEN %s AND %s
+                AND ma.instrumentalness BETWEEN %s AND %s
+                AND ma.acousticness BETWEEN %s AND %s
+                AND ma.mode = %s
             GROUP BY
                 t.track_name, speechiness
             ORDER BY 
-                speechiness {rap}   
+                speechiness * %s DESC -- 1 sorts by speechiness descending, -1 ascending
             LIMIT 5;
-    """
+"""
+
+# the parameters of playlist_statement for a set of preferences
+def playlist_params(preferences):
+
+    valence, bpm, mode, dance, energy = "=", "=", "Major", "=", "="
+    if preferences["dance"] in ["yes", "y"]:
+        valence, bpm, dance, energy = ">=", ">=", ">=", ">="
+    elif preferences["mood"] == 0 and preferences["dance"] in ["no", "n"]:
+        valence, bpm, mode, dance, energy = "<=", "<=", "Minor", "<=", "<="
+    
+    elif preferences["mood"] == 1 and preferences["dance"] in ["no", "n"]:
+        valence, bpm, mode, dance, energy = ">=", "<=", "Major", "<=", "<="
 
-    alt_query = """
+    inst_range = [0, 30] if preferences["lyrics"] in ["lyrics", "l"] else [70, 100] if preferences["lyrics"] in ["instrumentals", "i"] else [30, 70]
+    rap = 1 if preferences["rap"] in ["yes", "y"] else -1
+    acoustic = ">=" if preferences["acoustic"] in ["acoustic", "a"] else "<="
+
+    return (*comparison_bounds(valence, 50), *comparison_bounds(bpm, 120), *comparison_bounds(energy, 70),
+            *comparison_bounds(dance, 60), *inst_range, *comparison_bounds(acoustic, 50), mode, rap)
+
+# most streamed songs on Spotify, used when no track matches the preferences
+playlist_fallback_query = """
         SELECT
             T.track_name,
             a.artist_name
@@ -659,14 +1934,34 @@ def generate_playlist(preferences):
         JOIN TrackArtist ta ON T.track_id = ta.track_id
         JOIN Artist a ON ta.artist_id = a.artist_id
         JOIN StreamingMetric sm ON t.track_id = sm.track_id
-        WHERE sm.platform_id = 1 AND sm.metric_type = 'streams'
+        WHERE sm.platform_id = %s AND sm.metric_type = 'streams'
         ORDER BY sm.metric_value DESC
         LIMIT 5;
-    """
-    cursor.execute(query8)
-    songs = cursor.fetchall()
+"""
+
+# preference_key -> (songs, True if the songs are the fallback playlist), filled by precompute_playlists
+playlist_lookup = {}
+
+# run the playlist for all 48 preference combinations once, right after the data is loaded
+def precompute_playlists(cursor):
+    playlist_lookup.clear()
+    with call_site("playlist"):
+        cursor.execute(playlist_fallback_query, (lookup_id(cursor, "Platform", "Spotify"),))
+        fallback = cursor.fetchall()
+
+        for preferences in preference_combinations():
+            cursor.execute(playlist_statement, playlist_params(preferences))
+            songs = cursor.fetchall()
+            playlist_lookup[preference_key(preferences)] = (songs, False) if len(songs) >= 3 else (fallback, True)
+
+def generate_playlist(preferences):
 
-    if not songs or len(songs) < 3:
+    if preference_key(preferences) not in playlist_lookup: # e.g. an incremental run that had nothing to load
+        with pooled_connection() as conn:
+            precompute_playlists(conn.cursor())
+    songs, fallback = playlist_lookup[preference_key(preferences)]
+
+    if fallback:
         print("""
             [green]
             Your tastes must be very unique!
@@ -674,8 +1969,6 @@ def generate_playlist(preferences):
             Here's a playlist that includes songs enjoyed by most users: 
             [/green]
         """)
-        cursor.execute(alt_query)
-        songs = cursor.fetchall()
         return songs
 
     else:
@@ -815,6 +2108,697 @@ queries = {
 }
 
 
+# --- --- --- QUERY RESULT CACHE --- --- ---
+
+
+# the data only changes when runProgram() reloads, so results are cached per data version
+# key: (query id, parameters, DATA_VERSION), value: (rows, approximate size in bytes), least recently used first
+DATA_VERSION = 0
+result_cache = OrderedDict()
+result_cache_bytes = 0
+result_cache_lock = threading.Lock() # "Run all" reads and fills the cache from several threads
+
+# rough memory footprint of a result: the list, its tuples and their values
+def rows_size(rows):
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows)
+
+def clear_result_cache():
+    global result_cache_bytes
+    with result_cache_lock:
+        result_cache.clear()
+        result_cache_bytes = 0
+    playlist_lookup.clear()
+
+# called after every reload and drop, old keys can't match again so the cache is emptied too
+def bump_data_version():
+    global DATA_VERSION
+    DATA_VERSION += 1
+    clear_result_cache()
+
+# cached rows for key, None if they are not cached
+def cached_result(key):
+    with result_cache_lock:
+        if key not in result_cache:
+            return None
+        result_cache.move_to_end(key)
+        return result_cache[key][0]
+
+# keep rows for key, evicting the least recently used results until everything fits again
+def cache_result(key, rows, size=None):
+    global result_cache_bytes
+    size = size or rows_size(rows)
+    if size > RESULT_CACHE_MAX_BYTES: # a result bigger than the whole cache is not kept
+        return
+    with result_cache_lock:
+        if key not in result_cache:
+            result_cache[key] = (rows, size)
+            result_cache_bytes += size
+        while result_cache_bytes > RESULT_CACHE_MAX_BYTES:
+            _, (_, evicted_size) = result_cache.popitem(last=False)
+            result_cache_bytes -= evicted_size
+
+# rows of queries[query_id], from the cache when the same query already ran on the current data
+def run_query(cursor, query_id, params=None):
+    if use_columnar(query_id, params):
+        return columnar_queries[query_id](current_columnar_dataset())
+    key = (query_id, params, DATA_VERSION)
+    rows = cached_result(key)
+    if rows is None:
+        with call_site(f"query.{query_id}"):
+            cursor.execute(queries[query_id]["query"], params)
+            rows = cursor.fetchall()
+        cache_result(key, rows)
+    return rows
+
+# the same rows as run_query, page_size at a time, for results too big to hold at once
+# uncached results are read from the (unbuffered) cursor with fetchmany and only collected
+# for the cache while they fit under RESULT_CACHE_MAX_BYTES
+# MySQL drops a connection whose result is not read for net_write_timeout (60 s by default), which is
+# raised for this session (the pool resets it when the connection goes back)
+def query_pages(cursor, query_id, page_size=None, params=None):
+    page_size = page_size or PAGE_SIZE
+    key = (query_id, params, DATA_VERSION)
+    rows = columnar_queries[query_id](current_columnar_dataset()) if use_columnar(query_id, params) else cached_result(key)
+    if rows is not None:
+        for start in range(0, len(rows), page_size):
+            yield rows[start:start + page_size]
+        return
+
+    with call_site(f"query.{query_id}"): # the pages fetched later count for the same call site
+        if BACKEND != "sqlite":
+            cursor.execute("SET SESSION net_write_timeout = %s", (PAGE_WAIT_TIMEOUT,))
+        cursor.execute(queries[query_id]["query"], params)
+    kept, size, complete = [], 0, False
+    try:
+        while True:
+            page = cursor.fetchmany(page_size)
+            if not page:
+                complete = True
+                break
+            if kept is not None:
+                kept += page
+                size += rows_size(page)
+                kept = kept if size <= RESULT_CACHE_MAX_BYTES else None
+            yield page
+    finally:
+        # stopped early: the connection can't run another statement until the rest is read
+        while not complete and cursor.fetchmany(page_size):
+            pass
+    if kept is not None:
+        cache_result(key, kept, size)
+
+
+# --- --- --- RUN ALL QUERIES --- --- ---
+
+
+# one query on its own pooled connection, so several can run at the same time
+def run_query_pooled(query_id):
+    with pooled_connection() as conn:
+        return run_query(conn.cursor(), query_id)
+
+# every entry of the queries dict (or only query_ids) at once, the report takes as long as the slowest query
+# returns {query id: DataFrame}, and writes query<id>.csv files to export_dir if given
+def run_all_queries(export_dir=None, query_ids=None):
+    query_ids = query_ids or list(queries)
+    with ThreadPoolExecutor(max_workers=min(POOL_SIZE, len(query_ids))) as executor:
+        futures = {query_id: executor.submit(run_query_pooled, query_id) for query_id in query_ids}
+
+    report = {query_id: pd.DataFrame(future.result(), columns=queries[query_id]["dataframe"])
+              for query_id, future in futures.items()}
+
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+        for query_id, df in report.items():
+            df.to_csv(os.path.join(export_dir, f"query{query_id}.csv"), index=False)
+    return report
+
+
+# --- --- --- COLUMNAR ENGINE --- --- ---
+
+
+# queries 1, 4, 6 and 7 only filter and group one row per track, so with QUERY_ENGINE = "columnar" they
+# are answered from NumPy arrays of the cleaned CSV instead of the database (same rows and columns)
+# the arrays describe the file at filepath, so an "incremental" database holding older files can differ
+columnar_cache = {"key": None, "data": None}
+
+# one array per column, one entry per track, cleaned and de-duplicated the way the loaders do it
+def columnar_dataset(spotify_df):
+    tracks = unique_tracks(spotify_df).reset_index(drop=True)
+    track_artists = explode_artists(tracks['artist(s)_name'], range(len(tracks)))
+
+    # every artist keeps the spelling and the ID order of its first appearance, like the Artist table
+    lowered = track_artists["artist_name"].str.lower()
+    first_seen = pd.Series(range(len(lowered)), index=lowered.values).groupby(level=0).min()
+    names = track_artists["artist_name"].groupby(lowered.values).first()
+    track_artists = track_artists.assign(key=lowered.values).drop_duplicates(["track_id", "key"])
+    track_artists = track_artists.assign(order=track_artists["key"].map(first_seen)).sort_values(["track_id", "order"])
+    artists = track_artists["key"].map(names).groupby(track_artists["track_id"]).agg(tuple)
+
+    data = {column.replace('_%', ''): pd.to_numeric(tracks[column], errors="coerce").to_numpy("float64")
+            for column in ['bpm', 'danceability_%', 'valence_%', 'energy_%', 'acousticness_%', 'liveness_%', 'speechiness_%']}
+    data["track_name"] = tracks['track_name'].to_numpy(object)
+    data["artists"] = artists.reindex(range(len(tracks)), fill_value=()).to_numpy(object)
+    data["release_month"] = pd.to_numeric(tracks['released_month'], errors="coerce").to_numpy("float64")
+    data["mode"] = tracks['mode'].to_numpy(object)
+    data["spotify_chart"] = clean_metric_columns(tracks[['in_spotify_charts']])['in_spotify_charts'].to_numpy()
+    return data
+
+# the arrays for the current file and data version, parsed once
+def current_columnar_dataset():
+    key = (filepath, DATA_VERSION)
+    if columnar_cache["key"] != key:
+        columnar_cache["data"], columnar_cache["key"] = columnar_dataset(read_spotify_csv(filepath)), key
+    return columnar_cache["data"]
+
+# AVG() rounded like ROUND(): NULL without values, half to even for doubles
+def column_average(values, decimals=0):
+    values = values[~np.isnan(values)]
+    return round(float(values.mean()), decimals) if len(values) else None
+
+def columnar_query1(data):
+    month = data["release_month"]
+    seasons = {"Winter": [12, 1, 2], "Spring": [3, 4, 5], "Summer": [6, 7, 8], "Fall": [9, 10, 11]}
+    masks = {season: np.isin(month, season_months) for season, season_months in seasons.items()}
+    masks = {None: ~np.logical_or.reduce(list(masks.values())), **masks} # FIELD() puts NULL first
+
+    rows = []
+    for season, mask in masks.items():
+        if not mask.any():
+            continue
+        mode = data["mode"][mask]
+        rows.append((season, column_average(data["bpm"][mask], 4),
+                     float(np.floor(100 * (mode == "Major").sum() / len(mode) + 0.5)), # exact value, half up
+                     float(np.floor(100 * (mode == "Minor").sum() / len(mode) + 0.5)),
+                     *[column_average(data[column][mask]) for column in
+                       ["valence", "energy", "danceability", "acousticness", "liveness", "speechiness"]]))
+    return rows
+
+# rows of the tracks in mask, sorted by sort_keys (most significant first), limit rows
+def columnar_rows(data, mask, sort_keys, columns, limit):
+    index = np.flatnonzero(mask)
+    order = np.lexsort([key[index] for key in reversed(sort_keys)])
+    return [tuple(row) for row in zip(*[column[index[order]] for column in columns])][:limit]
+
+def artist_list(data, sort=False):
+    return np.array([", ".join(sorted(artists, key=str.lower) if sort else artists) for artists in data["artists"]], dtype=object)
+
+def columnar_query4(data):
+    mask = ((data["valence"] > 50) & (data["bpm"] > 130) & (data["energy"] > 70) & (data["danceability"] > 60)
+            & (data["acousticness"] < 30) & (data["speechiness"] < 33) & (data["liveness"] < 50))
+    return columnar_rows(data, mask, [data["bpm"], -data["valence"], -data["energy"], data["danceability"]],
+                         [data["track_name"], artist_list(data), data["bpm"]], 40)
+
+def columnar_query6(data):
+    chart = data["spotify_chart"]
+    mask = (data["energy"] > 70) & (data["speechiness"] < 10) & (chart >= 1) & (chart <= 20)
+    return columnar_rows(data, mask, [-data["energy"], chart],
+                         [data["track_name"], artist_list(data), data["energy"], data["speechiness"], chart], 10)
+
+def columnar_query7(data):
+    chart = data["spotify_chart"]
+    mask = (chart >= 1) & (chart <= 25) & (data["danceability"] > 80) & (data["valence"] > 80)
+    rows = columnar_rows(data, mask, [-data["danceability"], -data["valence"]],
+                         [data["track_name"], artist_list(data, sort=True), data["danceability"], data["valence"], chart], None)
+    return list(dict.fromkeys(rows))[:10] # SELECT DISTINCT
+
+columnar_queries = {"1": columnar_query1, "4": columnar_query4, "6": columnar_query6, "7": columnar_query7}
+
+# can query_id be answered without the database right now?
+def use_columnar(query_id, params=None):
+    return QUERY_ENGINE == "columnar" and query_id in columnar_queries and params is None and filepath is not None
+
+# a value both executors agree on: numbers (MySQL returns Decimal) rounded, comma lists sorted and lower case
+def normalised_value(value):
+    if isinstance(value, str):
+        return ", ".join(sorted(part.strip().lower() for part in value.split(",")))
+    if value is None:
+        return None
+    return round(float(value), 4)
+
+# same rows from both executors? (ignoring row order and the order of artists inside a row)
+def columnar_parity(cursor):
+    report = []
+    for query_id, executor in columnar_queries.items():
+        cursor.execute(queries[query_id]["query"])
+        sql_rows = cursor.fetchall()
+        engine_rows = executor(current_columnar_dataset())
+        normalised = [sorted((tuple(map(normalised_value, row)) for row in rows), key=repr) for rows in [sql_rows, engine_rows]]
+        report.append((query_id, len(sql_rows), len(engine_rows), "ok" if normalised[0] == normalised[1] else "MISMATCH"))
+    return pd.DataFrame(report, columns=["Query", "SQL Rows", "Columnar Rows", "Parity"])
+
+# median latency of each executor over `repeat` runs (the result cache is bypassed)
+def benchmark_engines(cursor, repeat=20):
+    start = time.perf_counter()
+    data = columnar_dataset(read_spotify_csv(filepath)) # parsed again, so the build is timed too
+    build_ms = (time.perf_counter() - start) * 1000
+
+    report = []
+    for query_id, executor in columnar_queries.items():
+        timings = {"sql": [], "columnar": []}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(queries[query_id]["query"])
+            cursor.fetchall()
+            timings["sql"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            executor(data)
+            timings["columnar"].append(time.perf_counter() - start)
+        sql_ms, columnar_ms = (float(np.median(timings[engine])) * 1000 for engine in ["sql", "columnar"])
+        report.append((query_id, round(sql_ms, 3), round(columnar_ms, 3), round(sql_ms / columnar_ms, 1)))
+    report.append(("CSV parse + arrays", None, round(build_ms, 3), None))
+    return pd.DataFrame(report, columns=["Query", "SQL ms", "Columnar ms", "Speedup"])
+
+
+# --- --- --- BENCHMARK SUITE --- --- ---
+
+
+# run function(*args), returns (its result, milliseconds it took)
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+# median milliseconds of `repeat` calls
+def median_ms(function, *args, repeat=None):
+    return float(np.median([timed(function, *args)[1] for _ in range(repeat or BENCHMARK_REPEAT)]))
+
+def execute_and_fetch(cursor, statement, params=None):
+    cursor.execute(statement, params)
+    return cursor.fetchall()
+
+# reload filepath from scratch with the batched loader, timing every phase and the INSERTs of every table
+# leaves the same database as "Initialize" in batched mode
+def benchmark_load(conn):
+    cursor = conn.cursor()
+    timings = {}
+    _, timings["load.drop_database"] = timed(drop_database, cursor, "spotify_db")
+    create_database(cursor)
+    _, timings["load.create_tables"] = timed(create_tables, cursor)
+    _, timings["load.parse_csv"] = timed(parse_spotify_csv, filepath) # always parsed, even when the cache has it
+    spotify_df, timings["load.read_csv"] = timed(read_spotify_csv, filepath) # what the loaders see, cached if possible
+    frames, timings["load.transform"] = timed(build_table_frames, cursor, spotify_df)
+
+    table_timings = {}
+    write_table_frames(cursor, frames, timings=table_timings)
+    timings.update({f"load.insert.{table}": ms for table, ms in table_timings.items()})
+
+    refresh_dimension_cache(cursor)
+    record_load(cursor, filepath, dataset_file_hash(filepath), len(frames["Track"]))
+    _, timings["load.create_indexes"] = timed(create_indexes, cursor)
+    _, timings["load.platform_stats"] = timed(refresh_platform_stats, cursor)
+    _, timings["load.commit"] = timed(conn.commit)
+    bump_data_version()
+    return timings, len(frames["Track"])
+
+# per query: the first run after the load (cold), later runs of the same SQL (warm) and run_query from the result cache
+def benchmark_queries(cursor):
+    timings = {}
+    for query_id, query in queries.items():
+        with call_site(f"query.{query_id}"):
+            _, timings[f"query.{query_id}.cold"] = timed(execute_and_fetch, cursor, query["query"])
+            timings[f"query.{query_id}.warm"] = median_ms(execute_and_fetch, cursor, query["query"])
+        run_query(cursor, query_id) # fills the cache
+        timings[f"query.{query_id}.cached"] = median_ms(run_query, cursor, query_id)
+    return timings
+
+# "h,y,l,e,y": the --playlist answers of a preference combination
+def preference_label(preferences):
+    mood, *answers = preference_key(preferences)
+    return ",".join(["h" if mood == 1 else "s", *answers])
+
+# the playlist SQL for all 48 preference combinations, and precompute_playlists as a whole
+def benchmark_playlists(cursor):
+    timings = {}
+    for preferences in preference_combinations():
+        with call_site("playlist"):
+            timings[f"playlist.{preference_label(preferences)}"] = median_ms(
+                execute_and_fetch, cursor, playlist_statement, playlist_params(preferences))
+    _, timings["playlist.precompute_all"] = timed(precompute_playlists, cursor)
+    return timings
+
+# load filepath and time everything on the configured BACKEND, returns the report that is saved as JSON
+# {"meta": {...}, "timings_ms": {"load.insert.Track": 12.3, "query.1.cold": 4.5, "playlist.h,y,l,e,y": 0.8, ...}}
+def run_benchmark():
+    conn = connect_db()
+    try:
+        load_timings, track_count = benchmark_load(conn)
+        cursor = conn.cursor()
+        timings = {**load_timings, **benchmark_queries(cursor), **benchmark_playlists(cursor)}
+    finally:
+        conn.close()
+
+    meta = {"backend": BACKEND, "file": os.path.basename(filepath), "tracks": track_count, "repeat": BENCHMARK_REPEAT,
+            "python": sys.version.split()[0], "pandas": pd.__version__, "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    return {"meta": meta, "timings_ms": {metric: round(ms, 3) for metric, ms in timings.items()}}
+
+# compare a report with an earlier one, metric by metric
+# REGRESSION: slower by more than threshold (a fraction) and by at least BENCHMARK_MIN_MS
+def compare_benchmarks(current, baseline, threshold=None):
+    threshold = BENCHMARK_THRESHOLD if threshold is None else threshold
+    rows = []
+    for metric, current_ms in current["timings_ms"].items():
+        baseline_ms = baseline["timings_ms"].get(metric)
+        if baseline_ms is None:
+            rows.append((metric, None, current_ms, None, "new"))
+            continue
+        change = (current_ms - baseline_ms) / baseline_ms if baseline_ms else 0.0
+        if change > threshold and current_ms - baseline_ms >= BENCHMARK_MIN_MS:
+            status = "REGRESSION"
+        elif change < -threshold and baseline_ms - current_ms >= BENCHMARK_MIN_MS:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((metric, baseline_ms, current_ms, round(change * 100, 1), status))
+    return pd.DataFrame(rows, columns=["Metric", "Baseline ms", "Current ms", "Change %", "Status"])
+
+
+# --- --- --- SYNTHETIC DATASET --- --- ---
+
+
+# the columns of the Kaggle file, in its order
+spotify_csv_columns = ['track_name', 'artist(s)_name', 'artist_count', 'released_year', 'released_month', 'released_day',
+                       *count_columns, 'bpm', 'key', 'mode', *percentage_columns]
+
+synthetic_keys = ['C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'] # the real file leaves C empty
+synthetic_syllables = ["ka", "lo", "mi", "ra", "zu", "té", "ne", "vi", "so", "ba", "ri", "ña", "do", "el", "ja", ""]
+synthetic_words = ["Love", "Night", "Dance", "Heart", "Fire", "Dream", "Summer", "Corazón", "Baby", "Lights", "Money",
+                   "Rain", "Forever", "Café", "Blue", "Gold", "Wild", "Niño", "Time", "Stay", "Hey, You", "Moonlight"]
+synthetic_chunk_rows = 10000 # rows drawn from one random generator, fixed so the output does not depend on memory settings
+days_in_month = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# the corrupt streams value of the real file (a row's attributes run together)
+synthetic_corrupt_value = "BPM110KeyAModeMajorDanceability53Valence75Energy69Acousticness7Instrumentalness0Liveness17Speechiness3"
+
+# "Kamira Zuténe"-style names, and how often each one shows up (a few artists are on many tracks)
+def synthetic_artists(rng, count):
+    syllables = np.array(synthetic_syllables)[rng.integers(0, len(synthetic_syllables), (count, 5))]
+    names = [f"{(first + second).capitalize() or 'Lil'} {(third + fourth + fifth).capitalize() or 'Jay'}"
+             for first, second, third, fourth, fifth in syllables]
+    popularity = 1 / np.arange(1, count + 1) ** 0.8
+    return np.array(names, dtype=object), popularity / popularity.sum()
+
+# 1234567 -> "1,234,567", the way the real file writes Deezer playlists and Shazam charts
+def with_thousands(values):
+    return [f"{value:,}" for value in values]
+
+# one chunk of rows, the distributions are rough fits of the real file
+def synthetic_chunk(rng, rows, artists, popularity):
+    artist_picks = rng.choice(len(artists), size=(rows, 8), p=popularity)
+    artist_count = np.minimum(rng.geometric(0.7, rows), 8)
+    artist_names = [list(dict.fromkeys(artists[picks[:count]])) for picks, count in zip(artist_picks, artist_count)]
+    words = np.array(synthetic_words)[rng.integers(0, len(synthetic_words), (rows, 2))]
+
+    month = rng.integers(1, 13, rows)
+    playlists = np.clip(rng.lognormal(7.6, 1.3, rows), 31, 60000).round().astype("int64")
+    streams = np.clip(playlists * rng.lognormal(10.9, 0.7, rows), 2762, 3.7e9).round().astype("int64")
+    shazam = np.where(rng.random(rows) < 0.55, 0, np.clip(rng.lognormal(4, 1.5, rows), 1, 1451).round().astype("int64"))
+    percentage = lambda mean, std, low, high: np.clip(rng.normal(mean, std, rows), low, high).round().astype("int64")
+
+    chunk = pd.DataFrame({
+        'track_name': [f"{first} {second}" for first, second in words],
+        'artist(s)_name': [", ".join(names) for names in artist_names],
+        'artist_count': [len(names) for names in artist_names],
+        'released_year': 2023 - np.minimum(rng.geometric(0.35, rows) - 1, 93),
+        'released_month': month,
+        'released_day': rng.integers(1, days_in_month[month - 1] + 1),
+        'in_spotify_playlists': playlists,
+        'in_spotify_charts': np.where(rng.random(rows) < 0.45, 0, np.minimum(rng.geometric(0.06, rows), 147)),
+        'streams': np.where(rng.random(rows) < SYNTHETIC_CORRUPT_RATE, synthetic_corrupt_value, streams.astype(str)),
+        'in_apple_playlists': np.clip(playlists / 80 * rng.lognormal(0, 0.6, rows), 0, 672).round().astype("int64"),
+        'in_apple_charts': np.where(rng.random(rows) < 0.1, 0, rng.integers(1, 276, rows)),
+        'in_deezer_playlists': with_thousands(np.clip(playlists / 15 * rng.lognormal(0, 0.7, rows), 0, 12367).round().astype("int64")),
+        'in_deezer_charts': np.where(rng.random(rows) < 0.6, 0, np.minimum(rng.geometric(0.15, rows), 58)),
+        'in_shazam_charts': np.where(rng.random(rows) < 0.05, "", with_thousands(shazam)),
+        'bpm': percentage(122, 28, 65, 206),
+        'key': np.where(rng.random(rows) < 0.1, "", np.array(synthetic_keys)[rng.integers(0, len(synthetic_keys), rows)]),
+        'mode': np.where(rng.random(rows) < 0.58, "Major", "Minor"),
+        'danceability_%': percentage(67, 14, 23, 96),
+        'valence_%': percentage(51, 23, 4, 97),
+        'energy_%': percentage(64, 16, 9, 97),
+        'acousticness_%': (rng.beta(0.7, 1.9, rows) * 97).round().astype("int64"),
+        'instrumentalness_%': np.where(rng.random(rows) < 0.9, 0, rng.integers(1, 92, rows)),
+        'liveness_%': np.clip(rng.lognormal(2.6, 0.6, rows), 3, 97).round().astype("int64"),
+        'speechiness_%': np.clip(rng.lognormal(1.9, 0.7, rows), 2, 64).round().astype("int64"),
+    })
+    return chunk[spotify_csv_columns]
+
+# write a Spotify-like CSV of SYNTHETIC_BASE_ROWS * scale rows to path, the same file for the same seed
+# rows are generated and written one chunk at a time, so a multi-GB file needs a few MB of memory
+def generate_spotify_csv(path, scale=10, seed=0, encoding="utf-8"):
+    total = SYNTHETIC_BASE_ROWS * scale
+    artists, popularity = synthetic_artists(np.random.default_rng([seed, 0]), max(500, total // 4))
+
+    with open(path, "w", encoding=encoding, newline="") as csv_file, Progress() as progress:
+        task = progress.add_task(f"[green]Writing {os.path.basename(path)}...", total=total)
+        for chunk_index, start in enumerate(range(0, total, synthetic_chunk_rows)):
+            rng = np.random.default_rng([seed, 1, chunk_index]) # each chunk has its own stream
+            chunk = synthetic_chunk(rng, min(synthetic_chunk_rows, total - start), artists, popularity)
+            chunk.to_csv(csv_file, header=start == 0, index=False)
+            progress.update(task, advance=len(chunk))
+    return total
+
+
+# --- --- --- INDEX ADVISOR --- --- ---
+
+
+# what EXPLAIN says about each table a statement reads: full scans, temporary tables and filesorts
+def explain_statement(cursor, label, statement, params=None):
+    cursor.execute(f"EXPLAIN {statement.strip().rstrip(';')}", params)
+    columns = [column[0].lower() for column in cursor.description]
+    findings = []
+
+    for row in cursor.fetchall():
+        plan = dict(zip(columns, row))
+        extra = plan.get("extra") or ""
+        issues = []
+        if plan.get("type") == "ALL":
+            issues.append("full table scan")
+        elif plan.get("type") == "index":
+            issues.append("full index scan")
+        if "Using temporary" in extra:
+            issues.append("temporary table")
+        if "Using filesort" in extra:
+            issues.append("filesort")
+        findings.append([label, plan.get("table"), plan.get("type"), plan.get("key") or "-",
+                         plan.get("rows"), ", ".join(issues) or "ok"])
+    return findings
+
+# EXPLAIN every entry in queries and every SQL generate_playlist can build
+def advise_indexes(cursor):
+    findings = []
+    for query_id, details in queries.items():
+        if query_id == "8":
+            continue # the playlist statements are explained below
+        findings += explain_statement(cursor, f"Query {query_id}", details["query"])
+
+    # the playlist variants mostly share a plan, each distinct table access is reported once
+    variants = set(playlist_params(preferences) for preferences in preference_combinations())
+    playlist_findings = []
+    for params in variants:
+        playlist_findings += explain_statement(cursor, f"Playlist ({len(variants)} variants)", playlist_statement, params)
+    findings += [list(finding) for finding in dict.fromkeys(
+        (label, table, access, key, "-", issues) for label, table, access, key, _, issues in playlist_findings)]
+    findings += explain_statement(cursor, "Playlist fallback", playlist_fallback_query,
+                                  (lookup_id(cursor, "Platform", "Spotify"),))
+
+    return pd.DataFrame(findings, columns=["Statement", "Table", "Access", "Index", "Rows", "Issues"])
+
+
+# --- --- --- HEADLESS COMMAND LINE --- --- ---
+
+
+# every option can also come from an environment variable, so cron jobs don't need the password on the command line
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description="Load the Spotify CSV into MySQL and/or run queries without the menu.",
+        epilog="example: python Group_8_Databases_BigData.py --file spotify-2023.csv --queries all --format jsonl")
+    parser.add_argument("--user", default=os.environ.get("SPOTIFY_DB_USER", "root"), help="MySQL user (SPOTIFY_DB_USER)")
+    parser.add_argument("--password", default=os.environ.get("SPOTIFY_DB_PASSWORD", ""), help="MySQL password (SPOTIFY_DB_PASSWORD)")
+    parser.add_argument("--host", default=os.environ.get("SPOTIFY_DB_HOST", "localhost"), help="MySQL host (SPOTIFY_DB_HOST)")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"], default=os.environ.get("SPOTIFY_BACKEND", BACKEND),
+                        help="database engine (SPOTIFY_BACKEND), sqlite needs no server or credentials")
+    parser.add_argument("--sqlite-path", default=os.environ.get("SPOTIFY_SQLITE_PATH", SQLITE_PATH),
+                        help="database file for the sqlite backend (SPOTIFY_SQLITE_PATH)")
+    parser.add_argument("--file", default=os.environ.get("SPOTIFY_CSV"),
+                        help="CSV file to load (SPOTIFY_CSV), leave out to query the existing database")
+    parser.add_argument("--load-mode", choices=list(loaders), default=os.environ.get("SPOTIFY_LOAD_MODE", LOAD_MODE),
+                        help="how the CSV is loaded (SPOTIFY_LOAD_MODE)")
+    parser.add_argument("--queries", default=os.environ.get("SPOTIFY_QUERIES", ""),
+                        help="comma separated query numbers, or 'all' (SPOTIFY_QUERIES)")
+    parser.add_argument("--playlist", default=os.environ.get("SPOTIFY_PLAYLIST"),
+                        help="answers for query 8 as mood,dance,lyrics,acoustic,rap, e.g. h,y,b,e,n (SPOTIFY_PLAYLIST)")
+    parser.add_argument("--engine", choices=["sql", "columnar"], default=os.environ.get("SPOTIFY_QUERY_ENGINE", QUERY_ENGINE),
+                        help="executor of queries 1, 4, 6 and 7 (SPOTIFY_QUERY_ENGINE), columnar needs --file")
+    parser.add_argument("--compare-engines", action="store_true",
+                        help="check that both executors return the same rows and time them, needs --file")
+    parser.add_argument("--check-schema", action="store_true",
+                        help="check that the loaded tables hold what read_csv's own dtypes read from --file")
+    parser.add_argument("--benchmark", metavar="JSON",
+                        help="reload --file with timings per load phase, query and playlist, saved to this JSON file")
+    parser.add_argument("--baseline", metavar="JSON",
+                        help="an earlier --benchmark file to compare with, exit code 3 if a timing regressed")
+    parser.add_argument("--threshold", type=float, default=BENCHMARK_THRESHOLD,
+                        help=f"slowdown counted as a regression, as a fraction (default {BENCHMARK_THRESHOLD})")
+    parser.add_argument("--generate", metavar="CSV",
+                        help="write a synthetic CSV with the Kaggle layout here first (e.g. to use as --file)")
+    parser.add_argument("--scale", type=int, default=10,
+                        help=f"rows of the synthetic CSV, in multiples of {SYNTHETIC_BASE_ROWS} (default 10)")
+    parser.add_argument("--seed", type=int, default=0, help="the same seed writes the same synthetic CSV (default 0)")
+    parser.add_argument("--metrics-file", default=os.environ.get("SPOTIFY_METRICS_FILE", METRICS_FILE),
+                        help="write statement counts and latency histograms here (Prometheus text) at the end (SPOTIFY_METRICS_FILE)")
+    parser.add_argument("--metrics-port", type=int, default=os.environ.get("SPOTIFY_METRICS_PORT", METRICS_PORT),
+                        help="also serve them on http://127.0.0.1:<port>/metrics while running (SPOTIFY_METRICS_PORT)")
+    parser.add_argument("--format", choices=["csv", "jsonl", "parquet"], default=os.environ.get("SPOTIFY_FORMAT", "csv"),
+                        help="output format (SPOTIFY_FORMAT)")
+    parser.add_argument("--output", default=os.environ.get("SPOTIFY_OUTPUT"),
+                        help="folder for one query<id> file per query (SPOTIFY_OUTPUT), default is stdout")
+    args = parser.parse_args(argv)
+
+    args.query_ids = list(queries) if args.queries.strip().lower() == "all" else \
+        [query_id.strip() for query_id in args.queries.split(",") if query_id.strip()]
+    unknown = [query_id for query_id in args.query_ids if query_id not in queries]
+    if unknown:
+        parser.error(f"unknown query number(s): {', '.join(unknown)}")
+    if args.format == "parquet" and not args.output:
+        parser.error("parquet is binary, give --output")
+
+    if args.playlist:
+        answers = [answer.strip().lower() for answer in args.playlist.split(",")]
+        if len(answers) != 5 or answers[0][:1] not in ["h", "s"]:
+            parser.error("--playlist needs five answers: mood,dance,lyrics,acoustic,rap")
+        args.preferences = {"mood": 1 if answers[0][0] == "h" else 0, "dance": answers[1], "lyrics": answers[2],
+                            "acoustic": answers[3], "rap": answers[4]}
+        if preference_key(args.preferences) not in {preference_key(p) for p in preference_combinations()}:
+            parser.error(f"invalid --playlist answers: {args.playlist}")
+        if "8" not in args.query_ids:
+            args.query_ids.append("8")
+    if (args.engine == "columnar" or args.compare_engines) and not args.file:
+        parser.error("the columnar engine reads the CSV, give --file")
+    if args.check_schema and not args.file:
+        parser.error("the schema check reads the CSV, give --file")
+    if args.benchmark and not args.file:
+        parser.error("the benchmark loads the CSV, give --file")
+    if args.baseline and not args.benchmark:
+        parser.error("--baseline is compared with a new --benchmark run")
+    if args.scale < 1:
+        parser.error("--scale must be at least 1")
+    if not args.file and not args.query_ids and not args.generate:
+        parser.error("nothing to do, give --generate, --file, --benchmark and/or --queries")
+    return args
+
+# write each result as query<id>.<format> in output_dir, or everything to stdout
+# (on stdout every row starts with a "query" field, csv: one table with one header over the columns of all
+# results, empty where a result has no such column, jsonl: one object per row)
+def write_results(results, output_format, output_dir=None):
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    csv_tables = []
+    for query_id, df in results.items():
+        name = f"query{query_id}" if query_id in queries else query_id
+        path = os.path.join(output_dir, f"{name}.{output_format}") if output_dir else None
+        labelled = df.assign(query=query_id)[["query", *df.columns]] # which result a stdout row belongs to
+        if output_format == "csv":
+            if path:
+                df.to_csv(path, index=False)
+            else:
+                csv_tables.append(labelled.astype(object)) # object keeps integers from turning into floats next to gaps
+        elif output_format == "jsonl":
+            if path:
+                df.to_json(path, orient="records", lines=True, force_ascii=False)
+            else:
+                sys.stdout.write(labelled.to_json(orient="records", lines=True, force_ascii=False))
+        else:
+            df.to_parquet(path, index=False)
+    if csv_tables:
+        sys.stdout.write(pd.concat(csv_tables, ignore_index=True).to_csv(index=False))
+
+# the whole run without input(): load (optional), run the queries in parallel, write the results
+# returns the exit code, progress and messages go to stderr so stdout only holds the results
+def run_headless(argv):
+    global filepath, LOAD_MODE, BACKEND, SQLITE_PATH, QUERY_ENGINE, METRICS_FILE
+    args = parse_arguments(argv)
+    results, regressed = {}, 0
+
+    # read the baseline before the benchmark runs, not after
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+            if not isinstance(baseline, dict) or not isinstance(baseline.get("timings_ms"), dict):
+                raise ValueError("no timings_ms")
+        except (OSError, ValueError) as err:
+            print(f"Error: {args.baseline} is not a benchmark file ({err})", file=sys.stderr)
+            return 1
+    config["user"], config["password"], config["host"] = args.user, args.password, args.host
+    BACKEND, SQLITE_PATH, QUERY_ENGINE, METRICS_FILE = args.backend, args.sqlite_path, args.engine, args.metrics_file
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+
+    try:
+        with redirect_stdout(sys.stderr):
+            if args.generate:
+                rows = generate_spotify_csv(args.generate, args.scale, args.seed)
+                print(f"[blue]Wrote {rows} synthetic rows to {args.generate} (seed {args.seed})[/blue]")
+
+            if args.file:
+                filepath, LOAD_MODE = args.file, args.load_mode
+
+            # the benchmark does its own (batched) load
+            if args.benchmark:
+                report = run_benchmark()
+                with open(args.benchmark, "w", encoding="utf-8") as report_file:
+                    json.dump(report, report_file, indent=2)
+                results["benchmark"] = pd.DataFrame(list(report["timings_ms"].items()), columns=["Metric", "ms"])
+                if baseline:
+                    comparison = compare_benchmarks(report, baseline, args.threshold)
+                    results["benchmark_comparison"] = comparison
+                    regressed = (comparison["Status"] == "REGRESSION").sum()
+                    print(f"[{'red' if regressed else 'green'}]{regressed} timing(s) regressed by more than "
+                          f"{args.threshold:.0%} against {args.baseline}[/{'red' if regressed else 'green'}]")
+
+            elif args.file:
+                if LOAD_MODE != "incremental":
+                    admin = connect_db()
+                    drop_database(admin.cursor(), "spotify_db")
+                    admin.close()
+                if not runProgram():
+                    return 1
+
+            # with answers, query 8 is the personalized playlist instead of the static fallback
+            sql_ids = [query_id for query_id in args.query_ids if not (args.playlist and query_id == "8")]
+            results.update(run_all_queries(query_ids=sql_ids) if sql_ids else {})
+            if args.playlist:
+                with pooled_connection() as conn:
+                    if preference_key(args.preferences) not in playlist_lookup:
+                        precompute_playlists(conn.cursor())
+                songs, _ = playlist_lookup[preference_key(args.preferences)]
+                results["8"] = pd.DataFrame([row[:2] for row in songs], columns=queries["8"]["dataframe"])
+
+            if args.compare_engines:
+                with pooled_connection() as conn:
+                    results["engine_parity"] = columnar_parity(conn.cursor())
+                    results["engine_benchmark"] = benchmark_engines(conn.cursor())
+            if args.check_schema:
+                with pooled_connection() as conn:
+                    results["schema_parity"] = schema_parity(conn.cursor(), args.file)
+
+        write_results(results, args.format, args.output)
+
+    except database_errors + (OSError,) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    except ImportError as err: # parquet needs pyarrow (or fastparquet)
+        print(f"Error: {err}\nInstall pyarrow to write parquet, or use --format csv/jsonl.", file=sys.stderr)
+        return 1
+    finally:
+        if METRICS_FILE: # also after a failed run, to see how far it got
+            write_metrics_file()
+    return 3 if regressed else 0
+
+
 # --- --- --- PREPARE DATA REPRESENTATION AND PRESET VARIABLES --- --- ---
 
 
@@ -841,6 +2825,33 @@ def display_dataframe(df, title="DataFrame Output"):
     # Print the table
     console.print(table)
 
+# show rows page by page (pager style) without building a DataFrame, returns how many were shown
+# one page is read ahead: the next page is fetched before the prompt, so there is no prompt after the last page,
+# and the pages after it only when the user asks for them; "q" closes the pages generator
+def display_pages(pages, columns, title="Query Output"):
+    pages = iter(pages)
+    shown = 0
+    page = next(pages, None)
+
+    while page:
+        table = Table(title=title if shown == 0 else None, caption=f"rows {shown + 1}-{shown + len(page)}",
+                      show_lines=True, title_style="bold magenta")
+        for column in columns:
+            table.add_column(column, style="cyan", justify="center", overflow="fold")
+
+        # one blue, one green row for better legibility
+        for i, row in enumerate(page, shown):
+            table.add_row(*[str(item) for item in row], style="blue" if i % 2 == 0 else "green")
+        console.print(table)
+        shown += len(page)
+
+        page = next(pages, None) # read ahead, to know whether there is anything left to ask for
+        if page and input("Enter for more rows, (q) to stop: ").strip().lower() in ["q", "quit", "stop"]:
+            if hasattr(pages, "close"):
+                pages.close()
+            break
+    return shown
+
 ProgramRunning = True # to exit program when needed... or bored
 QueriesRunning = False # to easily switch between menus
 menuSelector = "main"
@@ -853,8 +2864,14 @@ File = False
 # --- --- --- MAIN PROGRAM SCRIPT --- --- ---
                 
 
+# any argument runs the headless command line instead of the menu (see --help)
+if __name__ == "__main__" and len(sys.argv) > 1:
+    sys.exit(run_headless(sys.argv[1:]))
+
 if __name__ == "__main__":
 # start of program
+    if METRICS_PORT:
+        serve_metrics()
     
     while ProgramRunning:
 
@@ -916,9 +2933,9 @@ if __name__ == "__main__":
                 Connected = True
 
                 try:
-                    drop_database(cursor, "spotify_db")
-                    runProgram()
-                    FileCorrect = True
+                    if LOAD_MODE != "incremental": # an incremental load keeps the database and applies the changes
+                        drop_database(cursor, "spotify_db")
+                    FileCorrect = runProgram() # False when the load failed, the reason is printed already
 
                 except:
                     FileCorrect = False
@@ -942,7 +2959,7 @@ if __name__ == "__main__":
                 else:
                     print("""            
             [blue]SQL Connection already established.
-            File not found. Please enter filepath below:[/blue]
+            File not found or not loaded. Please enter filepath below:[/blue]
             """)
                     File = True
                     menuSelector = "superSecureRedirectionFil"
@@ -1034,6 +3051,7 @@ if __name__ == "__main__":
                     # try establishing the connection
                     conn = connect_db()
                     cursor = conn.cursor()
+                    reset_pool() # the pool picks up the new credentials
                     print("""
             [blue]SQL connection established.[/blue]
             """)
@@ -1119,8 +3137,11 @@ if __name__ == "__main__":
                         ans = input("Your Choice: ").strip().lower()
                         
                         filepath = ans
-                        drop_database(cursor, "spotify_db")
-                        runProgram()
+                        if LOAD_MODE != "incremental":
+                            conn.ping(reconnect=True) # this connection may have been idle past wait_timeout
+                            drop_database(cursor, "spotify_db")
+                        if not runProgram(): # the reason is printed already, e.g. tables from an older version
+                            raise RuntimeError("load failed")
                         print("""
             [blue]Filepath correct.
             Now showing the QUERIES.[/blue]
@@ -1132,7 +3153,7 @@ if __name__ == "__main__":
                     except:
                         while True:
                             print("""
-            [bold red]File not found. Retry (r) or EXIT program (e):[/bold red]
+            [bold red]File not found or not loaded. Retry (r) or EXIT program (e):[/bold red]
             """)
                             ans = input("Your choice: ").strip().lower()
 
@@ -1169,6 +3190,8 @@ if __name__ == "__main__":
                       
                 [bold blue](v)[/bold blue] [bold white]View[/bold white]
                 [bold blue](1-8)[/bold blue] [bold white]Explore[/bold white]
+                [bold blue](r)[/bold blue] [bold white]Run all[/bold white]
+                [bold blue](x)[/bold blue] [bold white]Index Advisor[/bold white]
                 [magenta](b)[/magenta] [bold white]Back to[/bold white] [magenta]MAIN MENU[/magenta]
                 [bold red](s)[/bold red] [bold white]Stop[/bold white]
                       
@@ -1194,6 +3217,32 @@ if __name__ == "__main__":
             [green]{value['description']}[/green]""")
                     print()
 
+                # run every query concurrently and show them as one report
+                elif choiceQuery in ["r", "run", "all"]:
+                    try:
+                        start = time.perf_counter()
+                        report = run_all_queries(REPORT_DIR)
+                        for query_id, df in report.items():
+                            display_dataframe(df, title=queries[query_id]['description'])
+                        print(f"[blue]{len(report)} queries ran in {time.perf_counter() - start:.2f} seconds.[/blue]")
+                        if REPORT_DIR:
+                            print(f"[blue]Report saved to {REPORT_DIR}.[/blue]")
+                    except database_errors as err:
+                        print(f"[red]Error: {err}[/red]")
+
+                # EXPLAIN every query and report full scans, temporary tables and filesorts
+                elif choiceQuery in ["x", "explain", "advisor"] and BACKEND != "mysql":
+                    print("[blue]The Index Advisor reads MySQL's EXPLAIN output, it needs BACKEND = \"mysql\".[/blue]")
+
+                elif choiceQuery in ["x", "explain", "advisor"]:
+                    try:
+                        with pooled_connection() as query_conn, call_site("index_advisor"):
+                            report = advise_indexes(query_conn.cursor())
+                        display_dataframe(report, title="[blue]Index Advisor: [/blue]EXPLAIN of every query")
+                        print(f"[blue]{(report['Issues'] != 'ok').sum()} of {len(report)} table accesses flagged.[/blue]")
+                    except database_errors as err:
+                        print(f"[red]Error: {err}[/red]")
+
                 # proceed if the choice is a valid query number...
                 elif choiceQuery in queries:
                     print(f"""
@@ -1210,34 +3259,31 @@ if __name__ == "__main__":
                     print() # empty line for aesthetics
 
                     if action in ["run", "r"]:
-                        query = queries[choiceQuery]["query"]
-
-                        if choiceQuery == "8":   
-                            try:
-                                songs = generate_playlist(get_user_preferences())
-                                results = [row[:2] for row in songs]
-                            except:
-                                print("[blue]An exception occurred.[/blue]")
-                                menuSelector = "main"
-                                QueriesRunning = False
-                        else:
-                            cursor.execute(query)
-                            results = cursor.fetchall()
-                        
-                        # display results
-                        if results:
-                            try:
-                                df = pd.DataFrame(results, columns=queries[choiceQuery]['dataframe'])
-
-                                display_dataframe(df, title=queries[choiceQuery]['description'])
-
-                                print("[italic]Best viewed with an extended Terminal.[/italic]")
+                        shown = 0
+                        try:
+                            if choiceQuery == "8":   
+                                try:
+                                    songs = generate_playlist(get_user_preferences())
+                                    shown = display_pages([[row[:2] for row in songs]], queries[choiceQuery]['dataframe'],
+                                                          title=queries[choiceQuery]['description'])
+                                except:
+                                    print("[blue]An exception occurred.[/blue]")
+                                    menuSelector = "main"
+                                    QueriesRunning = False
+                            else:
+                                # rows are rendered as they arrive, one page at a time
+                                with pooled_connection() as query_conn:
+                                    shown = display_pages(query_pages(query_conn.cursor(), choiceQuery),
+                                                          queries[choiceQuery]['dataframe'],
+                                                          title=queries[choiceQuery]['description'])
+                        except database_errors as err:
+                            print(f"[red]Error: {err}[/red]")
 
-                                # Display the DataFrame in the terminal 
-                            except:
-                                print("[blue]No data found for this query.[/blue]")
+                        # display results
+                        if shown:
+                            print("[italic]Best viewed with an extended Terminal.[/italic]")
                         else:
-                            print("/blue]No data found for this query.[/blue]")
+                            print("[blue]No data found for this query.[/blue]")
 
                     elif action in ["explore", "e"]:
                         exp = queries[choiceQuery]['explanation']
@@ -1273,6 +3319,26 @@ if __name__ == "__main__":
         [green]Check the code for an Easter Egg HERE.
         Or find the hidden password to print it.[/green]
         """)
+            # where the database time went since the program started
+            summary = statement_summary()
+            if summary.empty:
+                print("""
+            [blue]No statements sent to the database yet (or since the last reset).[/blue]
+            """)
+            else:
+                print(f"""
+            [blue]{summary["Statements"].sum()} statements, {summary["Rows"].sum()} rows returned, {summary["Total ms"].sum():.0f} ms in the database.[/blue]
+            """)
+                display_dataframe(summary, title="Statements by Call Site")
+                if METRICS_FILE:
+                    write_metrics_file()
+                    print(f"[blue]Metrics written to {METRICS_FILE} (Prometheus text format).[/blue]")
+                # start counting from zero, e.g. to measure one query or load on its own
+                if input("Reset the statement metrics (r) or Enter to go back: ").strip().lower() in ["r", "reset"]:
+                    clear_statement_metrics()
+                    print("""
+            [blue]Statement metrics reset.[/blue]
+            """)
             menuSelector = "main"
         
         elif menuSelector == "spoti":